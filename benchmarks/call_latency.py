@@ -0,0 +1,42 @@
+"""
+Compare the per-call latency of an in-process MAD-X instance against a MAD-X
+instance in a subprocess.
+
+Usage:
+    python benchmarks/call_latency.py [NUMBER]
+"""
+
+import sys
+import timeit
+
+from cpymad.madx import Madx
+
+
+def measure(madx, number):
+    libmadx = madx._libmadx
+    madx.input('x = 1;')
+    calls = {
+        'input': lambda: libmadx.input('y = x + 1;'),
+        'eval': lambda: libmadx.eval('x + 1'),
+        'get_var': lambda: libmadx.get_var('x'),
+    }
+    return {
+        name: min(timeit.repeat(call, number=number, repeat=3)) / number
+        for name, call in calls.items()
+    }
+
+
+def main(number=10000):
+    with Madx(stdout=False) as madx:
+        subprocess = measure(madx, number)
+    with Madx(inprocess=True) as madx:
+        madx.option(echo=False, info=False, warn=False)
+        inprocess = measure(madx, number)
+    print("{:<8} {:>12} {:>12}".format('call', 'subprocess', 'inprocess'))
+    for name in subprocess:
+        print("{:<8} {:>10.2f}us {:>10.2f}us".format(
+            name, subprocess[name] * 1e6, inprocess[name] * 1e6))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
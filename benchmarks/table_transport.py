@@ -0,0 +1,51 @@
+"""
+Compare the transfer of table columns through the pipe (pickle) against
+shared memory.
+
+Usage:
+    python benchmarks/table_transport.py [NUM_ELEMENTS] [REPEAT]
+"""
+
+import sys
+import timeit
+
+from cpymad.madx import Madx
+
+
+SEQUENCE = """
+q: quadrupole, l=1, k1=0.01;
+s1: sequence, l={length};
+{elements}
+endsequence;
+beam;
+use, sequence=s1;
+"""
+
+
+def setup(madx, num_elements):
+    madx.input(SEQUENCE.format(
+        length=2 * num_elements,
+        elements='\n'.join(
+            'q{}: q, at={};'.format(i, 2 * i + 1)
+            for i in range(num_elements))))
+    madx.twiss(sequence='s1', betx=1, bety=1)
+
+
+def fetch_all(madx):
+    table = madx.table.twiss
+    for column in table:
+        table[column]
+
+
+def main(num_elements=30000, repeat=5):
+    for shared_memory in (False, True):
+        with Madx(stdout=False, shared_memory=shared_memory) as madx:
+            setup(madx, num_elements)
+            time = min(timeit.repeat(
+                lambda: fetch_all(madx), number=1, repeat=repeat))
+            print("shared_memory={!s:5}: {:.3f} s".format(
+                shared_memory, time))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,48 @@
+"""
+Compare transfer time and peak memory of the plain minrpc wire format
+against the out-of-band pickle protocol 5 format for large arrays.
+
+Usage:
+    python benchmarks/wire_format.py [MEGABYTES]
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from minrpc.connection import Connection as PlainConnection
+from cpymad._rpc import Connection
+
+
+def transfer(cls, data):
+    recv_fd, send_fd = os.pipe()
+    conn = cls.from_fd(recv_fd, send_fd)
+    try:
+        tracemalloc.start()
+        start = time.perf_counter()
+        thread = threading.Thread(target=conn.send, args=(data,))
+        thread.start()
+        conn.recv()
+        thread.join()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        conn.close()
+    return elapsed, peak
+
+
+def main(megabytes=100):
+    data = np.random.random(megabytes * 2**20 // 8)
+    for cls in (PlainConnection, Connection):
+        elapsed, peak = transfer(cls, data)
+        print("{:<16}: {:.3f} s, peak memory {:.0f} MB".format(
+            cls.__module__, elapsed, peak / 2**20))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,56 @@
+"""
+Conversion of MAD-X table data to Apache Arrow.
+
+This module requires the optional dependency ``pyarrow``. It is used by
+:meth:`cpymad.madx.Table.to_arrow` and :meth:`cpymad.madx.Table.to_parquet`
+in the client only, since with some builds of MAD-X, importing pyarrow
+after libmadx aborts the process.
+"""
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from cpymad.types import Categorical
+
+
+__all__ = [
+    'to_arrow',
+    'write_parquet',
+]
+
+
+# String columns with many repeated values that are dictionary encoded:
+DICTIONARY_COLUMNS = ('name', 'keyword')
+
+
+def to_arrow(columns: dict, summary: dict = None) -> pa.Table:
+    """
+    Build an arrow table from column data.
+
+    :param dict columns: column arrays or :class:`~cpymad.types.Categorical`
+                         by name
+    :param dict summary: table summary, stored as schema metadata
+    """
+    arrays = [_to_array(name, data) for name, data in columns.items()]
+    metadata = {
+        str(key): str(value)
+        for key, value in (summary or {}).items()
+    }
+    return pa.Table.from_arrays(
+        arrays, names=list(columns), metadata=metadata)
+
+
+def write_parquet(path: str, columns: dict, summary: dict = None, **kwargs):
+    """Write column data to a parquet file, see :func:`to_arrow`. Additional
+    keyword arguments are passed to ``pyarrow.parquet.write_table``."""
+    pq.write_table(to_arrow(columns, summary), path, **kwargs)
+
+
+def _to_array(name, data):
+    if isinstance(data, Categorical):
+        if name in DICTIONARY_COLUMNS:
+            return pa.DictionaryArray.from_arrays(data.codes, data.categories)
+        data = data.categories[data.codes]
+    elif name in DICTIONARY_COLUMNS and data.dtype.kind == 'U':
+        return pa.array(data).dictionary_encode()
+    return pa.array(data)
@@ -15,24 +15,243 @@ python process from crashes due to incorrect use of MAD-X.
 
 from __future__ import absolute_import
 
-from minrpc.client import Client, RemoteProcessCrashed, RemoteProcessClosed
+from collections import namedtuple
+from concurrent.futures import Future
+from contextlib import contextmanager, suppress
+import ctypes
+import errno
+import itertools
+import os
+import pickle
+import reprlib
+import select
+import signal
+import struct
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from minrpc import connection, ipc
+from minrpc.client import (
+    Client, RemoteModule, RemoteProcessCrashed, RemoteProcessClosed)
+from minrpc.connection import read
+from minrpc.service import Service
+
+from cpymad import _shm
 
 
 __all__ = [
+    'CallStats',
+    'Connection',
     'LibMadxClient',
+    'LibMadxService',
+    'LocalLibMadx',
+    'Pipeline',
+    'RemoteLibMadx',
     'RemoteProcessCrashed',
     'RemoteProcessClosed',
+    'pipeline',
 ]
 
 
-class LibMadxClient(Client):
+# Accumulated statistics for calls of one function. Times are in seconds,
+# sizes in bytes (request and response messages):
+CallStats = namedtuple('CallStats', [
+    'count', 'wall_time', 'compute_time', 'bytes_sent', 'bytes_received'])
+
+
+# Message header: payload size, number of out-of-band buffers. This is
+# followed by the size of each buffer, the payload and the buffer contents:
+HEADER = struct.Struct("!QL")
+BUFSIZE = struct.Struct("!Q")
+
+# Maximum number of buffers per writev() call:
+IOV_MAX = 1024
+
+PICKLE5 = pickle.HIGHEST_PROTOCOL >= 5
+
+# Seconds to wait for a forked process to connect, see LibMadxClient.fork:
+FORK_TIMEOUT = 30
+
+# libmadx functions that may modify tables, see _CallRecorder.modified:
+MODIFYING_FUNCTIONS = frozenset([
+    'start', 'finish', 'input', 'apply_table_selections'])
+
+# Unique values for _CallRecorder.modified across all clients:
+_modifications = itertools.count(1)
+
+
+class Connection(connection.Connection):
+
+    """
+    Connection that sends large binary objects (such as numpy arrays) as
+    out-of-band buffers using pickle protocol 5.
+
+    The buffers are written directly from the memory of the object to the
+    pipe, and read directly into the memory that backs the unpickled object.
+    This avoids temporary copies of large arrays on both ends.
+
+    The total number of transferred bytes is counted in ``bytes_sent`` and
+    ``bytes_received``.
+    """
+
+    def __init__(self, recv, send):
+        super(Connection, self).__init__(recv, send)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def recv(self):
+        """Receive a pickled message from the remote end."""
+        size, nbufs = HEADER.unpack(read(self._recv, HEADER.size))
+        sizes = struct.unpack(
+            '!{}Q'.format(nbufs), read(self._recv, nbufs * BUFSIZE.size))
+        payload = read(self._recv, size)
+        buffers = [readinto(self._recv, bytearray(n)) for n in sizes]
+        self.bytes_received += (
+            HEADER.size + nbufs * BUFSIZE.size + size + sum(sizes))
+        return loads(payload, buffers)
+
+    def send(self, data):
+        """Send a pickled message to the remote end."""
+        self.bytes_sent += writev(self._send, dumps(data))
+
+
+def dumps(data) -> list:
+    """Serialize ``data`` into a list of buffers that make up a message."""
+    buffers = []
+    if PICKLE5:
+        payload = pickle.dumps(data, 5, buffer_callback=buffers.append)
+    else:
+        payload = pickle.dumps(data, -1)
+    buffers = [b.raw() for b in buffers]
+    header = HEADER.pack(len(payload), len(buffers)) + b''.join(
+        BUFSIZE.pack(b.nbytes) for b in buffers)
+    return [header, payload] + buffers
+
+
+def loads(payload, buffers):
+    """Deserialize a message from its payload and out-of-band buffers."""
+    if buffers:
+        return pickle.loads(payload, buffers=buffers)
+    return pickle.loads(payload)
+
+
+def readinto(file, buffer):
+    """Fill ``buffer`` completely with data from ``file``."""
+    view = memoryview(buffer)
+    while view:
+        size = file.readinto(view)
+        if not size:
+            raise EOFError
+        view = view[size:]
+    return buffer
+
+
+def writev(file, buffers) -> int:
+    """Write all ``buffers`` to ``file`` with as few syscalls as possible.
+    Returns the number of bytes written."""
+    views = [memoryview(b).cast('B') for b in buffers]
+    views = [v for v in views if v.nbytes]
+    total = sum(v.nbytes for v in views)
+    if not hasattr(os, 'writev'):
+        for view in views:
+            while view:
+                view = view[file.write(view):]
+        return total
+    fd = file.fileno()
+    while views:
+        size = os.writev(fd, views[:IOV_MAX])
+        # skip written data after partial writes:
+        while size and size >= views[0].nbytes:
+            size -= views.pop(0).nbytes
+        if size:
+            views[0] = views[0][size:]
+    return total
+
+
+class _CallRecorder:
+
+    """
+    Mixin that records :class:`CallStats` per function name in ``stats``.
+
+    If ``stats_callback`` is set, it is invoked after each call as
+    ``stats_callback(name, wall_time, compute_time, bytes_sent,
+    bytes_received)``, e.g. to export the measurements to a metrics system.
+    """
+
+    stats_callback = None
+
+    # Changes before every call that may modify tables. Clients use this to
+    # avoid asking MAD-X whether a cached table is still valid:
+    modified = 0
+
+    def _note_call(self, funcname):
+        if funcname in MODIFYING_FUNCTIONS:
+            self.modified = next(_modifications)
+
+    def _record(self, name, wall_time, compute_time, sent, received):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = CallStats(0, 0.0, 0.0, 0, 0)
+        self.stats[name] = CallStats(
+            stats.count + 1,
+            stats.wall_time + wall_time,
+            stats.compute_time + compute_time,
+            stats.bytes_sent + sent,
+            stats.bytes_received + received)
+        if self.stats_callback is not None:
+            self.stats_callback(name, wall_time, compute_time, sent, received)
+
+
+class LibMadxClient(_CallRecorder, Client):
 
     """
     Specialized client for boxing :mod:`cpymad.libmadx` function calls.
+
+    Records :class:`CallStats` for every request in ``stats``, keyed by the
+    function name (or the request kind for other requests). The compute time
+    is the time spent in the remote process to execute the request. Calls in
+    a :meth:`pipeline` are recorded under their function names with their
+    own compute time, while the wall time and the transferred bytes of the
+    request are split evenly among them.
+
+    If ``timeout`` is set, the remote process is killed if it does not reply
+    within that many seconds, and a :class:`TimeoutError` is raised.
     """
 
+    module = 'cpymad._rpc'
+
+    def __init__(self, conn, lock=None, proc=None, pid=None, timeout=None):
+        super(LibMadxClient, self).__init__(conn, lock=lock, proc=proc)
+        self.pid = proc.pid if proc else pid
+        self.stats = {}
+        self.timeout = timeout
+        self._compute_time = 0.0
+
+    @classmethod
+    def spawn_subprocess(cls, lock=None, **Popen_args):
+        """
+        Create client for a backend service in a subprocess.
+
+        You can use the keyword arguments to pass further arguments to
+        Popen, which is useful for example, if you want to redirect STDIO
+        streams.
+        """
+        args = [sys.executable, '-m', cls.module]
+        conn, proc = ipc.spawn_subprocess(args, **Popen_args)
+        conn = Connection(conn._recv, conn._send)
+        return cls(conn, lock=lock, proc=proc), proc
+
     def close(self):
         """Finalize libmadx if it is running."""
+        # Avoid requests (and watchdog threads) if called again, e.g. from
+        # __del__ during interpreter shutdown:
+        if self.closed:
+            return
         try:
             if self.libmadx.is_started():
                 self.libmadx.finish()
@@ -42,4 +261,494 @@ class LibMadxClient(Client):
 
     @property
     def libmadx(self):
-        return self.get_module('cpymad.libmadx')
+        return RemoteLibMadx(self, 'cpymad.libmadx')
+
+    @contextmanager
+    def pipeline(self, module='cpymad.libmadx'):
+        """
+        Queue function calls and send them as a single request when leaving
+        the context. Calls return :class:`~concurrent.futures.Future` objects
+        that are resolved afterwards, e.g.::
+
+            with client.pipeline() as libmadx:
+                x = libmadx.eval('x')
+                y = libmadx.eval('y')
+            print(x.result(), y.result())
+
+        The calls are executed sequentially in the remote process. A failing
+        call does not abort the remaining calls, its exception is stored in
+        the corresponding future.
+        """
+        pipe = Pipeline(self, module)
+        try:
+            yield pipe
+        except BaseException:
+            pipe.cancel()
+            raise
+        pipe.flush()
+
+    def fork(self, timeout: float = FORK_TIMEOUT) -> "LibMadxClient":
+        """
+        Fork the remote process and return a client for the new process.
+
+        The child process starts with a copy-on-write snapshot of the full
+        interpreter state of the remote process. The parent and child are
+        completely independent afterwards. Only available on POSIX systems.
+
+        :param float timeout: seconds to wait for the new process to connect
+        :raises TimeoutError: if the new process fails to connect in time
+        """
+        if not hasattr(os, 'fork'):
+            raise NotImplementedError("fork() is not available on this OS.")
+        deadline = time.monotonic() + timeout
+        with tempfile.TemporaryDirectory(prefix='cpymad-') as tempdir:
+            send_path = os.path.join(tempdir, 'send')
+            recv_path = os.path.join(tempdir, 'recv')
+            os.mkfifo(send_path)
+            os.mkfifo(recv_path)
+            self._request('fork', send_path, recv_path)
+            # NOTE: the order is important to avoid a deadlock, see
+            # LibMadxService._dispatch_fork:
+            send = _open_fifo(send_path, os.O_WRONLY, deadline)
+            try:
+                recv = _open_fifo(recv_path, os.O_RDONLY, deadline)
+            except BaseException:
+                send.close()
+                raise
+            conn = Connection(recv, send)
+            # Wait until the child has opened its end of the pipe and sent
+            # its PID, before the pipes are removed:
+            remaining = max(deadline - time.monotonic(), 0)
+            if not select.select([recv], [], [], remaining)[0]:
+                conn.close()
+                raise TimeoutError("The forked MAD-X process did not connect.")
+        client = self.__class__(conn, timeout=self.timeout)
+        client.pid = client._dispatch(conn.recv())
+        client.stats_callback = self.stats_callback
+        return client
+
+    @contextmanager
+    def with_timeout(self, timeout):
+        """Temporarily change the ``timeout`` for all requests."""
+        old, self.timeout = self.timeout, timeout
+        try:
+            yield
+        finally:
+            self.timeout = old
+
+    def kill(self):
+        """Kill the remote process."""
+        if self._proc:
+            self._proc.kill()
+        elif self.pid:
+            with suppress(OSError):
+                os.kill(self.pid, signal.SIGKILL)
+
+    def _request(self, kind, *args):
+        """Communicate with the remote service and record statistics."""
+        conn = self._conn
+        sent = getattr(conn, 'bytes_sent', 0)
+        received = getattr(conn, 'bytes_received', 0)
+        self._compute_time = 0.0
+        start = time.perf_counter()
+        if self.closed:
+            raise RemoteProcessClosed()
+        if not self._good:
+            raise RemoteProcessCrashed()
+        if kind == 'function_call':
+            self._note_call(args[1])
+        elif kind == 'pipeline':
+            for call in args[0]:
+                self._note_call(call[1])
+        timeout = self.timeout
+        watchdog = timeout is not None and _Watchdog(timeout, self.kill)
+        result = None
+        try:
+            result = super(LibMadxClient, self)._request(kind, *args)
+            # The reply may arrive just before the process is killed:
+            if watchdog and not watchdog.cancel():
+                raise RemoteProcessCrashed()
+            return result
+        except RemoteProcessCrashed:
+            if watchdog and watchdog.expired:
+                raise TimeoutError(
+                    "MAD-X did not respond within {} seconds to: {}".format(
+                        timeout, _describe(kind, args))) from None
+            raise
+        finally:
+            if watchdog:
+                watchdog.cancel()
+            wall_time = time.perf_counter() - start
+            sent = getattr(conn, 'bytes_sent', 0) - sent
+            received = getattr(conn, 'bytes_received', 0) - received
+            if kind == 'pipeline':
+                calls = args[0]
+                # Each response carries its compute time as last argument:
+                compute_times = (
+                    [reply[-1] for _, reply in result] if result is not None
+                    else [0.0] * len(calls))
+                for call, compute_time in zip(calls, compute_times):
+                    self._record(
+                        call[1],
+                        wall_time / len(calls),
+                        compute_time,
+                        sent // len(calls),
+                        received // len(calls))
+            else:
+                self._record(
+                    args[1] if kind == 'function_call' else kind,
+                    wall_time,
+                    self._compute_time,
+                    sent,
+                    received)
+
+    def _dispatch_data(self, data, compute_time=0.0):
+        """Dispatch returned data."""
+        self._compute_time = compute_time
+        return data
+
+    def _dispatch_exception(self, exc_type, message, compute_time=0.0):
+        """Dispatch an exception."""
+        self._compute_time = compute_time
+        return super(LibMadxClient, self)._dispatch_exception(
+            exc_type, message)
+
+
+def _open_fifo(path, flags, deadline):
+    """
+    Open a named pipe without blocking. Opening the write end is retried
+    until the read end has been opened by another process, or raises
+    :class:`TimeoutError` after ``deadline`` (see ``time.monotonic()``).
+    """
+    while True:
+        try:
+            fd = os.open(path, flags | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+        if time.monotonic() > deadline:
+            raise TimeoutError(
+                "The forked MAD-X process did not open {!r}.".format(path))
+        time.sleep(0.01)
+    os.set_blocking(fd, True)
+    return open(fd, 'wb' if flags == os.O_WRONLY else 'rb', 0)
+
+
+class _Watchdog:
+
+    """Calls ``kill`` if not cancelled within ``timeout`` seconds."""
+
+    def __init__(self, timeout, kill):
+        self.expired = False
+        self._cancelled = False
+        self._kill = kill
+        self._lock = threading.Lock()
+        self._timer = threading.Timer(timeout, self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _expire(self):
+        with self._lock:
+            if not self._cancelled:
+                self.expired = True
+                self._kill()
+
+    def cancel(self) -> bool:
+        """Stop the timer. Returns ``False`` if it has already expired."""
+        with self._lock:
+            self._cancelled = True
+            self._timer.cancel()
+            return not self.expired
+
+
+def _describe(kind, args) -> str:
+    """Format the request for error messages."""
+    if kind != 'function_call':
+        return kind
+    modname, funcname, args, kwargs = args
+    if funcname == 'input':
+        return args[0]
+    return '{}(*{}, **{})'.format(
+        funcname, reprlib.repr(args), reprlib.repr(kwargs))
+
+
+class RemoteLibMadx(RemoteModule):
+
+    """Wrapper for :mod:`cpymad.libmadx` in a :class:`LibMadxClient`."""
+
+    def __init__(self, client, module):
+        super(RemoteLibMadx, self).__init__(client, module)
+        self._client = client
+        self._module = module
+
+    def pipeline(self):
+        """Shortcut for :meth:`LibMadxClient.pipeline`."""
+        return self._client.pipeline(self._module)
+
+    @property
+    def modified(self):
+        """See :attr:`LibMadxClient.modified`."""
+        return self._client.modified
+
+    def _rebind(self, client):
+        """Forward all further calls to a different client."""
+        self._RemoteModule__client = client
+        self._client = client
+
+
+class Pipeline:
+
+    """
+    Queue of function calls for :meth:`LibMadxClient.pipeline`.
+
+    Any attribute access returns a function that queues a call to the
+    function of the same name and returns a future for its result.
+    """
+
+    def __init__(self, client, module):
+        self._client = client
+        self._module = module
+        self._calls = []
+        self._futures = []
+
+    def __getattr__(self, funcname):
+        def queue(*args, **kwargs):
+            future = Future()
+            self._calls.append((self._module, funcname, args, kwargs))
+            self._futures.append(future)
+            return future
+        return queue
+
+    def flush(self):
+        """Send all queued calls and resolve their futures."""
+        calls, futures = self._calls, self._futures
+        self._calls, self._futures = [], []
+        if not calls:
+            return
+        try:
+            responses = self._client._request('pipeline', calls)
+        except BaseException as e:
+            for future in futures:
+                future.set_exception(e)
+            raise
+        for future, response in zip(futures, responses):
+            try:
+                future.set_result(self._client._dispatch(response))
+            except Exception as e:
+                future.set_exception(e)
+
+    def cancel(self):
+        """Discard all queued calls."""
+        for future in self._futures:
+            future.cancel()
+        self._calls, self._futures = [], []
+
+
+class _LocalPipeline:
+
+    """Executes calls immediately, for use with a local libmadx module."""
+
+    def __init__(self, module):
+        self._module = module
+
+    def __getattr__(self, funcname):
+        function = getattr(self._module, funcname)
+
+        def call(*args, **kwargs):
+            future = Future()
+            try:
+                future.set_result(function(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return call
+
+
+class LocalLibMadx(_CallRecorder):
+
+    """
+    Wrapper for :mod:`cpymad.libmadx` loaded into the current process.
+
+    This avoids all IPC overhead, but a crash in MAD-X takes down the python
+    process. Since MAD-X uses global state and can not be fully reinitialized
+    after it has been finalized, only one instance can be created in each
+    process during its whole lifetime, i.e. also after the first instance
+    has been closed. Returned numpy arrays that reference MAD-X memory are
+    copied.
+
+    Records :class:`CallStats` like :class:`LibMadxClient`, where the wall
+    time equals the compute time and no bytes are transferred.
+    """
+
+    # Acquired by the first instance and never released:
+    _lock = threading.Lock()
+    # Set early, for __del__ if __init__ fails:
+    _closed = True
+
+    def __init__(self):
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError(
+                "MAD-X has already been loaded into this process. It can not "
+                "be reinitialized, so only one in-process instance can be "
+                "created per process, even after closing the previous one. "
+                "Use Madx(inprocess=False) to start MAD-X in a subprocess.")
+        from cpymad import libmadx
+        self._libmadx = libmadx
+        self._closed = False
+        self.stats = {}
+
+    def __del__(self):
+        self.close()
+
+    def __bool__(self):
+        return not self._closed
+
+    def __getattr__(self, funcname):
+        function = getattr(self._libmadx, funcname)
+
+        def call(*args, **kwargs):
+            if self._closed:
+                raise RemoteProcessClosed()
+            self._note_call(funcname)
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self._record(funcname, elapsed, elapsed, 0, 0)
+            if isinstance(result, np.ndarray) and result.base is not None:
+                return result.copy()
+            return result
+        return call
+
+    def close(self):
+        """Finalize libmadx."""
+        if not self._closed:
+            self._closed = True
+            if self._libmadx.is_started():
+                self._libmadx.finish()
+
+
+def pipeline(libmadx):
+    """
+    Return a context manager for pipelined calls to ``libmadx``, see
+    :meth:`LibMadxClient.pipeline`. If ``libmadx`` is not a remote module,
+    the calls are executed immediately.
+    """
+    if isinstance(libmadx, RemoteLibMadx):
+        return libmadx.pipeline()
+    return _local_pipeline(libmadx)
+
+
+@contextmanager
+def _local_pipeline(libmadx):
+    yield _LocalPipeline(libmadx)
+
+
+class LibMadxService(Service):
+
+    """
+    Counterpart to :class:`LibMadxClient` that runs in the remote process.
+
+    Replies include the time spent for executing the request as additional
+    argument.
+    """
+
+    _compute_time = 0.0
+
+    @classmethod
+    def stdio_main(cls, args):
+        """Do the full job of preparing and running an RPC service."""
+        conn = ipc.prepare_subprocess_ipc(args)
+        conn = Connection(conn._recv, conn._send)
+        try:
+            svc = cls(conn)
+            svc.configure_logging()
+            svc.run()
+        finally:
+            conn.close()
+            _shm.release_segments()
+
+    def _dispatch(self, request):
+        # The client has processed the previous reply, so any shared memory
+        # segments that it did not take over can be removed:
+        _shm.release_segments()
+        self._compute_time = 0.0
+        return super(LibMadxService, self)._dispatch(request)
+
+    def _dispatch_function_call(self, modname, funcname, args, kwargs):
+        """Execute any static function call and measure its time."""
+        start = time.perf_counter()
+        try:
+            return super(LibMadxService, self)._dispatch_function_call(
+                modname, funcname, args, kwargs)
+        finally:
+            self._compute_time += time.perf_counter() - start
+
+    def _reply_data(self, data):
+        """Return data to the client."""
+        try:
+            self._conn.send(('data', (data, self._compute_time)))
+        except BaseException:
+            _shm.release_segments()
+            raise
+
+    def _reply_exception(self, exc_info):
+        """Return an exception state to the client."""
+        message = "".join(traceback.format_exception(*exc_info))
+        self._conn.send(
+            ('exception', (exc_info[0], message, self._compute_time)))
+
+    def _dispatch_pipeline(self, calls):
+        """
+        Execute a list of function calls and return a list of responses,
+        each of which is formatted like a regular reply message.
+        """
+        responses = []
+        for call in calls:
+            start = time.perf_counter()
+            try:
+                data = self._dispatch_function_call(*call)
+            except Exception:
+                exc_info = sys.exc_info()
+                message = "".join(traceback.format_exception(*exc_info))
+                responses.append(('exception', (
+                    exc_info[0], message, time.perf_counter() - start)))
+            else:
+                responses.append(('data', (
+                    data, time.perf_counter() - start)))
+        return responses
+
+    def _dispatch_fork(self, recv_path, send_path):
+        """
+        Fork this process. The child serves requests on the named pipes at
+        ``recv_path``/``send_path``, and sends its PID as first message.
+        """
+        # Flush stdio buffers, otherwise pending output would be written by
+        # both processes:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        ctypes.CDLL(None).fflush(None)
+        pid = os.fork()
+        if pid:
+            os.waitpid(pid, 0)
+            return None
+        # Fork a second time, so that the grandchild is reparented to init,
+        # which takes care of reaping it after it terminates:
+        try:
+            if os.fork():
+                os._exit(0)
+            # Release our handles of the parent's pipes, otherwise the
+            # client would not be able to detect if the parent crashes:
+            self._conn.close()
+            recv = open(recv_path, 'rb', 0)
+            send = open(send_path, 'wb', 0)
+            self._conn = Connection(recv, send)
+        except BaseException:
+            os._exit(1)
+        return os.getpid()
+
+
+if __name__ == '__main__':
+    LibMadxService.stdio_main(sys.argv[1:])
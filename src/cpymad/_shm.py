@@ -0,0 +1,117 @@
+"""
+Transfer numpy arrays between processes via shared memory.
+
+The remote process copies the array into a new shared memory segment and
+only sends a small :class:`SharedArray` descriptor over the pipe. The client
+maps the segment and wraps it as numpy array without copying the data.
+
+The client takes ownership of the segment: it is unlinked as soon as it has
+been mapped and unmapped automatically after the last array referencing it
+has been deleted. Segments whose descriptor never reached the client are
+unlinked by the remote process, see :func:`release_segments`.
+"""
+
+import os
+from collections import namedtuple
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:         # python < 3.8
+    SharedMemory = None
+
+
+__all__ = [
+    'available',
+    'SharedArray',
+    'share_array',
+    'attach_array',
+    'release_segments',
+]
+
+
+# On windows, the segment is destroyed as soon as the last handle is closed,
+# i.e. before the client has a chance to open it:
+available = SharedMemory is not None and os.name == 'posix'
+
+
+# Descriptor for an array in a shared memory segment:
+SharedArray = namedtuple('SharedArray', ['name', 'shape', 'dtype'])
+
+# Names of the segments created for the current reply (remote side):
+_pending = []
+
+
+def share_array(array: np.ndarray) -> SharedArray:
+    """Copy array into a new shared memory segment (remote side)."""
+    array = np.ascontiguousarray(array)
+    shm = _create_segment(max(array.nbytes, 1))
+    try:
+        np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+    finally:
+        shm.close()
+    _pending.append(shm.name)
+    return SharedArray(shm.name, array.shape, array.dtype.str)
+
+
+def release_segments():
+    """
+    Unlink all segments created by :func:`share_array` that have not been
+    unlinked by the client (remote side). This must be called only after
+    the client has processed the reply, i.e. when it sends the next request
+    or has disconnected, or if sending the reply failed.
+    """
+    while _pending:
+        try:
+            shm = SharedMemory(_pending.pop())
+        except FileNotFoundError:
+            continue
+        shm.unlink()
+        shm.close()
+
+
+def attach_array(data):
+    """Map array from a :class:`SharedArray` descriptor (client side). Other
+    values are passed through unchanged."""
+    if not isinstance(data, SharedArray):
+        return data
+    shm = SharedMemory(data.name)
+    shm.unlink()
+    return np.asarray(_Segment(shm, data.shape, data.dtype))
+
+
+def _create_segment(size: int) -> SharedMemory:
+    # The segment is owned by the client, so we must prevent the resource
+    # tracker from removing it when the remote process exits:
+    try:
+        return SharedMemory(create=True, size=size, track=False)
+    except TypeError:       # python < 3.13
+        shm = SharedMemory(create=True, size=size)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class _Segment:
+
+    """
+    Owner of a shared memory mapping that serves as base object for numpy
+    arrays. This keeps the mapping alive as long as any array uses it.
+
+    (Arrays created directly from ``shm.buf`` would prevent ``shm.close()``
+    and cause errors when the :class:`SharedMemory` is deleted first.)
+    """
+
+    def __init__(self, shm, shape, dtype):
+        self._shm = shm
+        address = np.frombuffer(shm.buf, np.uint8).ctypes.data
+        self.__array_interface__ = {
+            'version': 3,
+            'shape': tuple(shape),
+            'typestr': dtype,
+            'data': (address, False),
+        }
+
+    def __del__(self):
+        self._shm.close()
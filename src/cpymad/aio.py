@@ -0,0 +1,319 @@
+"""
+Asyncio interface for MAD-X interpreters.
+
+The :class:`AsyncMadx` class provides awaitable versions of the most
+important :class:`~cpymad.madx.Madx` methods. The MAD-X process is driven
+via non-blocking pipe I/O, so a single event loop can run many interpreters
+concurrently::
+
+    async def run(i):
+        async with AsyncMadx(stdout=False) as madx:
+            await madx.input(sequence)
+            twiss = await madx.twiss(sequence='s1', betx=1, bety=1)
+            return await twiss.column('betx')
+
+    results = await asyncio.gather(*(run(i) for i in range(20)))
+"""
+
+import asyncio
+import os
+import pickle
+import struct
+import subprocess
+import sys
+
+from minrpc import ipc
+from minrpc.client import Client
+from minrpc.connection import HEADER as READY_HEADER
+
+from . import _rpc
+from . import util
+from .madx import Command, CommandLog, TwissFailed
+
+
+__all__ = [
+    'AsyncMadx',
+    'AsyncTable',
+]
+
+
+class AsyncClient:
+
+    """
+    Asynchronous counterpart of :class:`~cpymad._rpc.LibMadxClient`.
+
+    Requests are serialized by a lock, i.e. there is at most one request
+    in flight per remote process.
+    """
+
+    def __init__(self, reader, writer, proc):
+        self._reader = reader
+        self._writer = writer
+        self._proc = proc
+        self._lock = asyncio.Lock()
+        self._good = True
+
+    def __bool__(self):
+        return self._good and not self.closed
+
+    good = property(__bool__)
+
+    @classmethod
+    async def spawn_subprocess(cls, **Popen_args):
+        """Create client for a libmadx service in a subprocess."""
+        conn, remote_recv, remote_send = ipc.create_ipc_connection()
+        args = [sys.executable, '-m', _rpc.LibMadxClient.module,
+                str(int(remote_recv)), str(int(remote_send))]
+        with open(os.devnull, 'w+') as devnull:
+            for stream in ('stdout', 'stderr', 'stdin'):
+                if Popen_args.get(stream) is False:
+                    Popen_args[stream] = devnull
+            proc = subprocess.Popen(args, close_fds=False, **Popen_args)
+        remote_recv.close()
+        remote_send.close()
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), conn._recv)
+        transport, protocol = await loop.connect_write_pipe(
+            asyncio.streams.FlowControlMixin, conn._send)
+        writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+        # the handshake still uses the plain minrpc wire format:
+        header = await reader.readexactly(READY_HEADER.size)
+        ready = await reader.readexactly(*READY_HEADER.unpack(header))
+        if pickle.loads(ready) != 'ready':
+            raise RuntimeError("Failed to start MAD-X process.")
+        return cls(reader, writer, proc)
+
+    @property
+    def closed(self):
+        """Check if connection is closed."""
+        return self._writer.is_closing()
+
+    async def close(self):
+        """Close the connection gracefully, stop the remote service."""
+        if self.good:
+            try:
+                await self._send(('close', ()))
+            except (OSError, ConnectionError):
+                pass
+        self._good = False
+        self._writer.close()
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._proc.wait)
+
+    async def call(self, funcname, *args, **kwargs):
+        """Call a function in :mod:`cpymad.libmadx` in the remote process."""
+        return await self._request(
+            'function_call', 'cpymad.libmadx', funcname, args, kwargs)
+
+    async def _request(self, kind, *args):
+        """Communicate with the remote service."""
+        async with self._lock:
+            if self.closed:
+                raise _rpc.RemoteProcessClosed()
+            if not self._good:
+                raise _rpc.RemoteProcessCrashed()
+            try:
+                await self._send((kind, args))
+                response = await self._recv()
+            except (asyncio.IncompleteReadError, ConnectionError, OSError):
+                self._good = False
+                self._writer.close()
+                raise _rpc.RemoteProcessCrashed() from None
+        return self._dispatch(response)
+
+    async def _send(self, data):
+        for buffer in _rpc.dumps(data):
+            self._writer.write(buffer)
+        await self._writer.drain()
+
+    async def _recv(self):
+        read = self._reader.readexactly
+        size, nbufs = _rpc.HEADER.unpack(await read(_rpc.HEADER.size))
+        sizes = struct.unpack(
+            '!{}Q'.format(nbufs), await read(nbufs * _rpc.BUFSIZE.size))
+        payload = await read(size)
+        buffers = [bytearray(await read(n)) for n in sizes]
+        return _rpc.loads(payload, buffers)
+
+    _dispatch = Client._dispatch
+
+    def _dispatch_data(self, data, compute_time=0.0):
+        """Dispatch returned data."""
+        return data
+
+    def _dispatch_exception(self, exc_type, message, compute_time=0.0):
+        """Dispatch an exception."""
+        Client._dispatch_exception(self, exc_type, message)
+
+
+class AsyncMadx:
+
+    """
+    Asyncio interface for a MAD-X process.
+
+    The process is started when entering the ``async with`` block or by
+    awaiting :meth:`start`. Calls to the same instance are executed one
+    after another, calls to different instances run concurrently.
+    """
+
+    def __init__(self, command_log=None, history=None, prompt=None,
+                 **Popen_args):
+        """
+        Initialize instance variables.
+
+        :param command_log: Log all MAD-X commands issued via cpymad.
+        :param str prompt: prefix for a new :class:`CommandLog`
+        :param Popen_args: Additional parameters to ``subprocess.Popen``
+
+        Contrary to :class:`~cpymad.madx.Madx`, ``stdout`` can not be a
+        python callable, but must be a file descriptor, file object with a
+        ``fileno()``, ``None`` or ``False``.
+        """
+        if isinstance(command_log, str):
+            command_log = CommandLog.create(command_log, prompt or '')
+        elif hasattr(command_log, 'write'):
+            command_log = CommandLog(command_log, prompt or '')
+        elif prompt is not None:
+            command_log = CommandLog(sys.stdout, prompt)
+        Popen_args.setdefault('stdin', False)
+        Popen_args.setdefault('bufsize', 0)
+        self.history = history
+        self._command_log = command_log
+        self._Popen_args = Popen_args
+        self._service = None
+        self._commands = {}
+
+    def __bool__(self):
+        """Check if the MAD-X process is up and running."""
+        return bool(self._service)
+
+    async def start(self) -> "AsyncMadx":
+        """Spawn the MAD-X process and initialize MAD-X."""
+        self._service = await AsyncClient.spawn_subprocess(
+            **self._Popen_args)
+        await self._service.call('start')
+        return self
+
+    async def quit(self):
+        """Shutdown MAD-X interpreter and stop process."""
+        if self._service is None:
+            return
+        try:
+            await self.input('quit;')
+        except RuntimeError:
+            pass
+        await self._service.close()
+        if hasattr(self._command_log, 'close'):
+            self._command_log.close()
+            self._command_log = None
+
+    exit = quit
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.quit()
+
+    async def _call(self, funcname, *args, **kwargs):
+        if self._service is None:
+            raise _rpc.RemoteProcessClosed()
+        try:
+            return await self._service.call(funcname, *args, **kwargs)
+        except _rpc.RemoteProcessCrashed:
+            raise RuntimeError("MAD-X has stopped working!") from None
+
+    async def input(self, text: str) -> bool:
+        """
+        Run any textual MAD-X input.
+
+        :param text: command text
+        :returns: whether the command has completed without error
+        """
+        text = text.rstrip(';') + ';'
+        if self.history is not None:
+            self.history.append(text)
+        if self._command_log:
+            self._command_log(text)
+        return await self._call('input', text)
+
+    __call__ = input
+
+    async def command(self, name: str, *args, **kwargs) -> bool:
+        """
+        Run a MAD-X command with the given arguments, e.g.::
+
+            await madx.command('beam', particle='proton')
+        """
+        cmd = self._commands.get(name)
+        if cmd is None:
+            data = await self._call('get_defined_command', name)
+            cmd = self._commands[name] = Command(self, data)
+        return await self.input(util.format_command(cmd, *args, **kwargs))
+
+    async def eval(self, expr) -> float:
+        """
+        Evaluates an expression and returns the result as double.
+
+        :param str expr: expression to evaluate.
+        :returns: numeric value of the expression
+        """
+        if isinstance(expr, (float, int, bool)):
+            return expr
+        if isinstance(expr, list):
+            return [await self.eval(x) for x in expr]
+        return await self._call('eval', expr)
+
+    async def twiss(self, **kwargs) -> "AsyncTable":
+        """
+        Run TWISS.
+
+        :param str sequence: name of sequence
+        :param kwargs: keyword arguments for the MAD-X command
+        """
+        if not await self.command('twiss', **kwargs):
+            raise TwissFailed()
+        table = kwargs.get('table', 'twiss')
+        if 'file' not in kwargs:
+            await self._call('apply_table_selections', table)
+        return self.table(table)
+
+    def table(self, name: str) -> "AsyncTable":
+        """Get a handle for the table with the given name."""
+        return AsyncTable(self, name)
+
+
+class AsyncTable:
+
+    """
+    Handle for a MAD-X table. Columns are fetched on demand and not cached.
+    """
+
+    def __init__(self, madx, name):
+        self._madx = madx
+        self._name = name.lower()
+
+    def __repr__(self):
+        return "<{} {!r}>".format(self.__class__.__name__, self._name)
+
+    async def col_names(self) -> list:
+        """Get list of all columns in the table."""
+        return await self._madx._call('get_table_column_names', self._name)
+
+    async def column(self, column: str, rows='all'):
+        """Retrieve all specified rows in the given column of the table.
+
+        :param column: column name
+        :param rows: a list of row indices or ``'all'`` or ``'selected'``
+        """
+        return await self._madx._call(
+            'get_table_column', self._name, column.lower(), rows)
+
+    async def copy(self, columns=None, rows='all') -> dict:
+        """Return a dict containing the specified columns."""
+        if columns is None:
+            columns = await self.col_names()
+        return {column: await self.column(column, rows)
+                for column in columns}
@@ -0,0 +1,157 @@
+"""
+:class:`concurrent.futures.Executor` that runs functions on MAD-X
+interpreters in worker processes.
+
+Each worker process initializes one :class:`~cpymad.madx.Madx` instance and
+runs the ``setup`` on it. Submitted functions are called with this instance
+as first argument. Only their return value is sent back, so table data can
+be reduced in the worker::
+
+    from cpymad.executor import MadxExecutor, as_completed
+
+    def max_betx(madx, kqf):
+        madx.globals.kqf = kqf
+        return madx.twiss(sequence='fodo').betx.max()
+
+    with MadxExecutor(setup='call, file="fodo.madx";') as executor:
+        results = list(executor.map(max_betx, values, chunksize=16))
+"""
+
+from concurrent.futures import Executor, ProcessPoolExecutor, as_completed
+from functools import partial
+from itertools import chain, islice
+import multiprocessing
+import os
+import sys
+
+from .madx import Madx
+
+
+__all__ = [
+    'MadxExecutor',
+    'as_completed',
+]
+
+
+class MadxExecutor(ProcessPoolExecutor):
+
+    """
+    Process pool with one initialized MAD-X interpreter per worker.
+
+    :param int max_workers: number of worker processes, defaults to the
+                            number of CPUs
+    :param setup: MAD-X input (str) or function ``setup(madx)`` that is
+                  executed once in each worker
+    :param madx_args: keyword arguments for :class:`~cpymad.madx.Madx`
+
+    By default, MAD-X runs in a separate subprocess of each worker. Pass
+    ``inprocess=True`` to load MAD-X directly into the worker processes
+    instead, which avoids the IPC overhead of every call. In this mode,
+    ``stdout=False`` suppresses the MAD-X output of the workers, and a crash
+    in MAD-X breaks the executor (see
+    :class:`~concurrent.futures.process.BrokenProcessPool`). The in-process
+    mode is incompatible with the ``recover`` and ``timeout`` arguments, and
+    with functions that use pandas or pyarrow: with some builds, importing
+    these modules after MAD-X has been loaded aborts the worker process.
+
+    In the in-process mode, workers are started with the ``'spawn'`` method
+    by default, because forked workers would inherit the state of an
+    in-process MAD-X instance of the main process.
+
+    Functions, arguments and return values must be picklable. Exceptions
+    raised by MAD-X (i.e. in libmadx) are passed on as instances of their
+    original builtin type, with the remote traceback as message.
+    """
+
+    def __init__(self, max_workers: int = None, setup=None, *,
+                 mp_context=None, **madx_args):
+        if mp_context is None and madx_args.get('inprocess'):
+            mp_context = multiprocessing.get_context('spawn')
+        super(MadxExecutor, self).__init__(
+            max_workers, mp_context=mp_context,
+            initializer=_initialize, initargs=(setup, madx_args))
+
+    def submit(*args, **kwargs):
+        """
+        Schedule ``fn(madx, *args, **kwargs)`` to be executed in a worker.
+
+        :returns: :class:`~concurrent.futures.Future` for the return value
+        """
+        self, fn, args = args[0], args[1], args[2:]
+        return super(MadxExecutor, self).submit(_call, fn, *args, **kwargs)
+
+    def map(self, fn, *iterables, timeout=None, chunksize=1):
+        """
+        Return an iterator for ``fn(madx, *args)`` for all tuples of
+        ``args`` from ``iterables``. Items are sent to the workers in chunks
+        of ``chunksize``, which can significantly improve the performance
+        for many quick calls.
+        """
+        if chunksize < 1:
+            raise ValueError("chunksize must be >= 1.")
+        # NOTE: We can't use ProcessPoolExecutor.map, since it passes its
+        # own function to our submit(), which would then be called with the
+        # MAD-X instance:
+        results = Executor.map(
+            self, partial(_call_chunk, fn),
+            _chunks(zip(*iterables), chunksize),
+            timeout=timeout)
+        return chain.from_iterable(results)
+
+
+# The MAD-X instance of the current worker process:
+_madx = None
+
+
+def _initialize(setup, madx_args):
+    """Create and set up the MAD-X instance in a worker process."""
+    global _madx
+    if madx_args.get('inprocess') and 'stdout' in madx_args:
+        if madx_args.pop('stdout') is False:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, 1)
+            os.close(devnull)
+    _madx = Madx(**madx_args)
+    if isinstance(setup, str):
+        _madx.input(setup)
+    elif setup is not None:
+        setup(_madx)
+
+
+def _call(fn, *args, **kwargs):
+    try:
+        return fn(_madx, *args, **kwargs)
+    except Exception as e:
+        raise _picklable_exception(e) from None
+
+
+def _call_chunk(fn, madx, chunk):
+    return [fn(madx, *args) for args in chunk]
+
+
+def _picklable_exception(exc):
+    """
+    Return ``exc``, or if it is a remote exception of a libmadx subprocess,
+    an exception of the original type. The exception types created by
+    :class:`minrpc.client.Client` for remote exceptions can not be pickled.
+    """
+    for cls in type(exc).__mro__:
+        module = sys.modules.get(cls.__module__)
+        if getattr(module, cls.__qualname__, None) is not cls:
+            continue
+        if cls is type(exc):
+            return exc
+        try:
+            return cls(str(exc))
+        except Exception:
+            continue
+    return RuntimeError(str(exc))
+
+
+def _chunks(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
@@ -17,7 +17,9 @@ CAUTION: End users should usually not import this module directly! Use
 """
 
 import os
+import re
 import ctypes
+from itertools import product
 import numpy as np      # Import the Python-level symbols of numpy
 
 # Import a large-enough integer type to hold pointer, see also:
@@ -29,14 +31,35 @@ cdef extern from "string.h" nogil:
     char* strstr(char* s1, char* s2)
     char* strchr(char* s, int c)
 
-from cpymad.types import Constraint, Parameter, AlignError, FieldError, PhaseError
+from cpymad.types import (
+    Constraint, Parameter, AlignError, FieldError, PhaseError, Categorical)
 from cpymad.util import name_to_internal, name_from_internal, normalize_range_name
+from cpymad._shm import share_array
 cimport cpymad.clibmadx as clib
 
 
 # Remember whether start() was called
 _madx_started = False
 
+# Generation of each table by name, see get_table_generation():
+_table_generations = {}
+_table_generation = 0
+
+# Selected row indices by table name, see _get_table_selected_rows():
+_selected_rows = {}
+
+# Element indices by name in the expanded sequences, see _get_expanded_index():
+_expanded_indices = {}
+
+# Entry and exit positions of the nodes in every sequence, see
+# _get_position_index():
+_position_indices = {}
+
+# Matches inputs that consist only of variable/attribute assignments:
+_ASSIGNMENTS = re.compile(
+    r'(\s*((const|real|int)\s+)*[a-z_][\w.]*(->[\w.]+)?\s*:?=[^;]*;)+\s*',
+    re.IGNORECASE)
+
 
 # Python-level binding to libmadx:
 __all__ = [
@@ -53,6 +76,7 @@ __all__ = [
 
     # Globals
     'get_var',
+    'set_vars',
     'num_globals',
     'get_globals',
     'get_var_type',
@@ -80,9 +104,12 @@ __all__ = [
     'get_table_column_names',
     'get_table_column_count',
     'get_table_column',
+    'get_table_columns',
+    'get_table_matrix',
     'get_table_row',
     'get_table_row_count',
     'get_table_row_names',
+    'get_table_generation',
 
     'get_table_selected_rows',
     'get_table_selected_rows_mask',
@@ -95,6 +122,7 @@ __all__ = [
     'get_element_names',
     'get_element_index',
     'get_element_index_by_position',
+    'get_element_indices_by_position',
     'get_element_count',
 
     # expanded sequence element access
@@ -106,10 +134,15 @@ __all__ = [
     'get_expanded_element_index_by_position',
     'get_expanded_element_count',
 
+    # columnar access to all elements of a sequence
+    'get_element_table',
+    'get_error_arrays',
+
     # global elements
     'get_global_element',
     'get_global_element_name',
     'get_global_element_index',
+    'get_global_element_base_types',
     'get_global_element_count',
 
     # element base types
@@ -198,6 +231,10 @@ def input(cmd: str) -> bool:
         clib.pro_input(_pch)
         error = clib.geterrorflag()
         clib.clearerrorflag()
+    if not _ASSIGNMENTS.fullmatch(cmd):
+        _invalidate_tables(None)
+        _expanded_indices.clear()
+        _position_indices.clear()
     return not error
 
 
@@ -223,6 +260,30 @@ def get_var(name: str) -> Parameter:
         dtype=typeid, inform=inform, var_type=var.type)
 
 
+def set_vars(names, values) -> None:
+    """
+    Assign numeric values to global variables without invoking the parser.
+
+    :param list names: variable names
+    :param values: array of values
+    :raises ValueError: if the number of names and values differ
+
+    This has the same effect as the input ``name = value;`` for every
+    variable, i.e. existing variables become direct variables, new variables
+    are created, and constants are not modified.
+    """
+    # copy, since the buffer may be read-only if received via pickle:
+    cdef double[:] _values = np.array(values, dtype=float).ravel()
+    if len(names) != _values.shape[0]:
+        raise ValueError("Got {} values for {} variables."
+                         .format(_values.shape[0], len(names)))
+    cdef bytes _name
+    cdef int i
+    for i in range(_values.shape[0]):
+        _name = _cstr(names[i].lower())
+        clib.set_variable(_name, &_values[i])
+
+
 def get_var_type(name: str) -> int:
     """
     Get the type of the variable:
@@ -435,12 +496,15 @@ def get_table_column_count(table_name: str, selected: bool = False) -> int:
         return table.columns.curr
 
 
-def get_table_column(table_name: str, column_name: str, rows='all') -> np.ndarray:
+def get_table_column(table_name: str, column_name: str, rows='all',
+                     shared: bool = False, compact: bool = False):
     """
     Get data from the specified table.
 
     :param str table_name: table name
     :param str column_name: column name
+    :param bool shared: return numeric data in a shared memory segment
+    :param bool compact: return string data as :class:`~cpymad.types.Categorical`
     :returns: the data in the requested column
     :raises ValueError: if the column cannot be found in the table
     :raises RuntimeError: if the column has unknown type
@@ -449,34 +513,30 @@ def get_table_column(table_name: str, column_name: str, rows='all') -> np.ndarra
     sure to copy all data before invoking any further MAD-X commands! This
     is done automatically for you if using libmadx in a remote service
     (pickle serialization effectively copies the data).
+
+    If ``shared`` is true, numeric data is copied to a new shared memory
+    segment and a :class:`cpymad._shm.SharedArray` descriptor is returned
+    instead, see :func:`cpymad._shm.attach_array`.
     """
-    cdef char** char_tmp
+    cdef clib.table* table = _find_table(table_name)
     cdef bytes _tab_name = _cstr(table_name)
     cdef bytes _col_name = _cstr(column_name)
     cdef clib.column_info info = clib.table_get_column(_tab_name, _col_name)
     dtype = <bytes> info.datatype
-    # row indices:
-    if isinstance(rows, str):
-        if rows == 'all':
-            indices = np.arange(info.length)
-        elif rows == 'selected':
-            indices = get_table_selected_rows(table_name)
-        else:
-            raise ValueError("Invalid value for rows:", rows)
-    else:
-        indices = np.arange(info.length)[rows]
+    indices = _get_table_row_indices(table, rows)
     # double:
     if dtype == b'i' or dtype == b'd':
         # YES, integers are internally stored as doubles in MAD-X:
         if info.length == 0:
-            return np.empty(0)
+            data = np.empty(0)
         else:
-            return np.ctypeslib.as_array(
+            data = np.ctypeslib.as_array(
                 <double [:info.length]> info.data)[indices]
+        return share_array(data) if shared else data
     # string:
     elif dtype == b'S':
-        char_tmp = <char**> info.data
-        return np.array([_str(char_tmp[i]) for i in indices], dtype=str)
+        return _get_string_column(
+            <char**> info.data, _iter_row_indices(table, indices), compact)
     # invalid:
     elif dtype == b'V':
         raise ValueError("Column {!r} is not in table {!r}."
@@ -487,6 +547,99 @@ def get_table_column(table_name: str, column_name: str, rows='all') -> np.ndarra
                            .format(_str(dtype), column_name))
 
 
+def get_table_columns(table_name: str, columns='all', rows='all',
+                      shared: bool = False, compact: bool = False) -> tuple:
+    """
+    Get data of multiple columns at once.
+
+    :param str table_name: table name
+    :param columns: list of column names or ``'all'`` or ``'selected'``
+    :param rows: list of row indices or ``'all'`` or ``'selected'``
+    :param bool shared: return the numeric block in a shared memory segment
+    :param bool compact: return string columns as
+                         :class:`~cpymad.types.Categorical`
+    :returns: tuple ``(names, data, strings)``: ``data`` is a contiguous 2-D
+              float64 array with one row per numeric column listed in
+              ``names``, and ``strings`` maps the names of string columns to
+              their data
+    :raises ValueError: if the table or a column cannot be found
+    :raises RuntimeError: if a column has unknown type
+
+    If ``shared`` is true, the numeric block is returned as
+    :class:`cpymad._shm.SharedArray`, see :func:`get_table_column`.
+    """
+    cdef clib.table* table = _find_table(table_name)
+    cdef int i, j
+    if isinstance(columns, str):
+        columns = get_table_column_names(
+            table_name, selected=columns == 'selected')
+    indices = _get_table_row_indices(table, rows)
+    names = []
+    col_indices = []
+    strings = {}
+    for name in columns:
+        i = clib.name_list_pos(_cstr(name.lower()), table.columns)
+        if i < 0:
+            raise ValueError("Column {!r} is not in table {!r}."
+                             .format(name, table_name))
+        inform = table.columns.inform[i]
+        if inform == clib.PARAM_TYPE_INTEGER or \
+                inform == clib.PARAM_TYPE_DOUBLE:
+            names.append(name)
+            col_indices.append(i)
+        elif inform == clib.PARAM_TYPE_STRING:
+            strings[name] = _get_string_column(
+                table.s_cols[i], _iter_row_indices(table, indices), compact)
+        else:
+            raise RuntimeError("Unknown datatype {!r} in column {!r}."
+                               .format(inform, name))
+    data = np.empty((len(names), len(_iter_row_indices(table, indices))))
+    if table.curr > 0:
+        for j, i in enumerate(col_indices):
+            data[j] = np.asarray(<double[:table.curr]> table.d_cols[i])[indices]
+    return names, share_array(data) if shared else data, strings
+
+
+def get_table_matrix(table_name: str, prefix: str, dims, rows='all',
+                     shared: bool = False):
+    """
+    Get a matrix that is stored elementwise in the columns of a table, e.g.
+    the transfer matrix in the columns ``r11`` … ``r66``.
+
+    :param str table_name: table name
+    :param str prefix: column name prefix, e.g. ``'r'``, ``'t'`` or ``'sig'``
+    :param tuple dims: shape of the matrix, e.g. ``(6, 6)``
+    :param rows: list of row indices or ``'all'`` or ``'selected'``
+    :param bool shared: return the array in a shared memory segment
+    :returns: array of shape ``(len(rows),) + dims``
+    :raises ValueError: if the table or a column cannot be found
+
+    The column for the matrix element ``[i, j, …]`` is named
+    ``prefix + str(i+1) + str(j+1) + …``.
+    """
+    cdef clib.table* table = _find_table(table_name)
+    cdef double* column
+    cdef Py_ssize_t i, j, n
+    dims = tuple(dims)
+    indices = np.arange(table.curr, dtype=np.intp)[
+        _get_table_row_indices(table, rows)]
+    cdef Py_ssize_t[:] rows_view = indices
+    result = np.empty((len(indices), int(np.prod(dims, dtype=int))))
+    cdef double[:, :] result_view = result
+    for j, ijk in enumerate(product(*map(range, dims))):
+        name = prefix.lower() + ''.join(str(k+1) for k in ijk)
+        i = clib.name_list_pos(_cstr(name), table.columns)
+        if i < 0 or table.columns.inform[i] not in (
+                clib.PARAM_TYPE_INTEGER, clib.PARAM_TYPE_DOUBLE):
+            raise ValueError("Column {!r} is not in table {!r}."
+                             .format(name, table_name))
+        column = table.d_cols[i]
+        for n in range(rows_view.shape[0]):
+            result_view[n, j] = column[rows_view[n]]
+    result = result.reshape((len(indices),) + dims)
+    return share_array(result) if shared else result
+
+
 def get_table_row(table_name: str, row_index: int, columns='all') -> dict:
     """
     Return row as tuple of values.
@@ -564,18 +717,35 @@ def get_table_row_names(table_name: str, indices='all') -> list:
     return [_get_table_row_name(table, i) for i in indices]
 
 
+def get_table_generation(table_name: str) -> tuple:
+    """
+    Get a token that changes whenever the table may have been modified.
+
+    :param str table_name: table name
+    :returns: opaque token that can be compared for equality
+    :raises ValueError: if the table cannot be found
+
+    All tables are considered modified by any input other than plain
+    assignments of variables, since MAD-X may reallocate or overwrite tables
+    in place without any observable change, e.g. within loops or MATCH. A
+    table is also modified by :func:`apply_table_selections`.
+    """
+    _find_table(table_name)
+    generation = _table_generations.setdefault(
+        table_name, _table_generation)
+    return (os.getpid(), generation)
+
+
 def get_table_selected_rows(table_name: str) -> list:
     """Return list of selected row indices in table (may be empty)."""
     cdef clib.table* table = _find_table(table_name)
-    return [i for i in range(table.curr) if table.row_out.i[i]]
+    return _get_table_selected_rows(table, table_name).tolist()
 
 
 def get_table_selected_rows_mask(table_name: str) -> np.ndarray:
     """Return boolean mask of which rows are selected in a table."""
     cdef clib.table* table = _find_table(table_name)
-    return np.array(
-        [table.row_out.i[i] for i in range(table.curr)],
-        dtype=bool)
+    return _get_table_row_flags(table).astype(bool)
 
 
 def apply_table_selections(table_name: str):
@@ -590,6 +760,7 @@ def apply_table_selections(table_name: str):
     version_info = tuple(map(int, get_version_number().split('.')))
     if version_info > (5,3,7):       # will crash before
         clib.out_table(_cstr(table_name), t, NULL)
+    _invalidate_tables([table_name])
 
 
 def get_element(sequence_name: str, element_index: int) -> dict:
@@ -677,22 +848,33 @@ def get_element_index_by_position(sequence_name: str, position: float) -> int:
 
     :param str sequence_name: sequence name
     :param float position: position (S coordinate)
-    :returns: the index of an element at that position, -1 if not found
-    :raises ValueError: if the sequence or element name is invalid
+    :returns: the index of the first element at that position
+    :raises ValueError: if the sequence is invalid or there is no element
+                        at the position
+    """
+    cdef clib.sequence* seq = _find_sequence(sequence_name)
+    index = _find_positions(
+        _get_position_index(seq, sequence_name, False), [position])[0]
+    if index < 0:
+        raise ValueError("No element found at position: {0}".format(position))
+    return int(index)
+
+
+def get_element_indices_by_position(sequence_name: str, positions,
+                                    expanded: bool = False) -> np.ndarray:
+    """
+    Return indices of the elements at the specified positions.
+
+    :param str sequence_name: sequence name
+    :param positions: array of positions (S coordinates)
+    :param bool expanded: use the expanded instead of the original sequence
+    :returns: integer array with the index of the first element at every
+              position, or -1 if there is no element at the position
+    :raises ValueError: if the sequence is invalid
     """
-    # This is implemented here just for performance, but still uses a linear
-    # algorithm. If you want more, you need to copy the elements over and use
-    # a suitable ordered data type.
     cdef clib.sequence* seq = _find_sequence(sequence_name)
-    cdef double _position = position
-    cdef clib.node* elem
-    cdef double at
-    for i in range(seq.nodes.curr):
-        elem = seq.nodes.nodes[i]
-        at = _get_node_entry_pos(elem, seq.ref_flag, seq.n_nodes > 0)
-        if _position >= at and _position <= at+elem.length:
-            return i
-    raise ValueError("No element found at position: {0}".format(position))
+    return _find_positions(
+        _get_position_index(seq, sequence_name, expanded), positions)
 
 
 def get_element_count(sequence_name: str) -> int:
@@ -779,22 +961,17 @@ def get_expanded_element_index(sequence_name: str, element_name: str) -> int:
     """
     Return index of element with specified name in the expanded sequence.
 
-    NOTE: this is the brute-force linear-time algorithm and therefore not
-    recommended for frequent execution.
-
     :param str sequence_name: sequence name
-    :param str element_name: element index
-    :returns: the index of the specified element, -1 if not found
-    :raises ValueError: if the sequence is invalid
+    :param str element_name: element name
+    :returns: the index of the specified element
+    :raises ValueError: if the sequence or element name is invalid
     """
-    # Unfortunately, there is no name_list for the expanded list. Therefore,
-    # Therefore, we can only provide a linear-time lookup.
     cdef clib.sequence* seq = _find_sequence(sequence_name)
-    cdef bytes _element_name = _cstr(name_to_internal(element_name))
-    for i in range(seq.n_nodes):
-        if seq.all_nodes[i].name == _element_name:
-            return i
-    raise ValueError("Element name not found: {0!r}".format(element_name))
+    index = _get_expanded_index(seq, sequence_name).get(
+        _cstr(name_to_internal(element_name)))
+    if index is None:
+        raise ValueError("Element name not found: {0!r}".format(element_name))
+    return index
 
 
 def get_expanded_element_index_by_position(sequence_name: str, position: float) -> int:
@@ -803,22 +980,16 @@ def get_expanded_element_index_by_position(sequence_name: str, position: float)
 
     :param str sequence_name: sequence name
     :param float position: position (S coordinate)
-    :returns: the index of an element at that position
-    :raises ValueError: if the sequence or element name is invalid
+    :returns: the index of the first element at that position
+    :raises ValueError: if the sequence is invalid or there is no element
+                        at the position
     """
-    # This is implemented here just for performance, but still uses a linear
-    # algorithm. If you want more, you need to copy the elements over and use
-    # a suitable ordered data type.
     cdef clib.sequence* seq = _find_sequence(sequence_name)
-    cdef double _position = position
-    cdef clib.node* elem
-    cdef double at
-    for i in range(seq.n_nodes):
-        elem = seq.all_nodes[i]
-        at = _get_node_entry_pos(elem, seq.ref_flag, seq.n_nodes > 0)
-        if _position >= at and _position <= at+elem.length:
-            return i
-    raise ValueError("No element found at position: {0}".format(position))
+    index = _find_positions(
+        _get_position_index(seq, sequence_name, True), [position])[0]
+    if index < 0:
+        raise ValueError("No element found at position: {0}".format(position))
+    return int(index)
 
 
 def get_expanded_element_count(sequence_name: str) -> int:
@@ -833,6 +1004,135 @@ def get_expanded_element_count(sequence_name: str) -> int:
     return seq.n_nodes
 
 
+def get_element_table(sequence_name: str, attrs=(), expanded: bool = False,
+                      expressions: bool = False) -> dict:
+    """
+    Get the attributes of all elements of a sequence as columns.
+
+    :param str sequence_name: sequence name
+    :param list attrs: names of numeric element attributes
+    :param bool expanded: use the expanded instead of the original sequence
+    :param bool expressions: add the columns ``<attr>_expr`` with the
+                             expression of every attribute
+    :returns: arrays ``name``, ``base_type``, ``parent``, ``position``,
+              ``length`` and the requested attributes by column name
+    :raises ValueError: if the sequence is invalid
+
+    Attributes that are not defined for an element are set to NaN, and
+    their expression is empty.
+    """
+    cdef clib.sequence* seq = _find_sequence(sequence_name)
+    cdef clib.node** nodes = seq.all_nodes if expanded else seq.nodes.nodes
+    cdef int count = seq.n_nodes if expanded else seq.nodes.curr
+    cdef clib.node* node
+    cdef clib.element* elem
+    cdef clib.command_parameter* par
+    cdef int i, j, k
+    attrs = [attr.lower() for attr in attrs]
+    keys = [_cstr(attr) for attr in attrs]
+    names, base_types, parents = [], [], []
+    position = np.empty(count)
+    length = np.empty(count)
+    values = np.full((len(attrs), count), np.nan)
+    exprs = [[''] * count for attr in attrs]
+    for i in range(count):
+        node = nodes[i]
+        elem = node.p_elem
+        names.append(_node_name(node))
+        position[i] = _get_node_entry_pos(node, seq.ref_flag, seq.n_nodes > 0)
+        length[i] = node.length
+        if elem is NULL:
+            base_types.append('sequence')
+            parents.append('')
+            continue
+        base_types.append(_str(elem.base_type.name))
+        parents.append(_str(elem.parent.name))
+        for j in range(len(keys)):
+            k = clib.name_list_pos(keys[j], elem.def_.par_names)
+            if k < 0:
+                continue
+            par = elem.def_.par.parameters[k]
+            if par.type in (clib.PARAM_TYPE_LOGICAL,
+                            clib.PARAM_TYPE_INTEGER,
+                            clib.PARAM_TYPE_DOUBLE):
+                value, expr = _expr(par.expr, par.double_value)
+                values[j, i] = value
+                exprs[j][i] = expr or ''
+    data = {
+        'name': np.array(names, dtype=str),
+        'base_type': np.array(base_types, dtype=str),
+        'parent': np.array(parents, dtype=str),
+        'position': position,
+        'length': length,
+    }
+    data.update(zip(attrs, values))
+    if expressions:
+        data.update({
+            attr + '_expr': np.array(expr, dtype=str)
+            for attr, expr in zip(attrs, exprs)
+        })
+    return data
+
+
+def get_error_arrays(sequence_name: str) -> dict:
+    """
+    Get the errors of all nodes in the expanded sequence that have errors
+    assigned, e.g. by EALIGN or EFCOMP.
+
+    :param str sequence_name: sequence name
+    :returns: dict with the following arrays, one row per node with errors:
+              ``index`` and ``name`` of the node, ``align`` with the 14
+              columns of :class:`~cpymad.types.AlignError`, and ``dkn``,
+              ``dks``, ``dpn``, ``dps`` with the components of the field and
+              phase errors, padded with zeros up to the highest order.
+    :raises ValueError: if the sequence is invalid
+    """
+    cdef clib.sequence* seq = _find_sequence(sequence_name)
+    cdef clib.node* node
+    cdef int i, j, k
+    cdef int field_order = 0, phase_order = 0
+    indices = []
+    for i in range(seq.n_nodes):
+        node = seq.all_nodes[i]
+        if (node.p_al_err is not NULL or
+                node.p_fd_err is not NULL or
+                node.p_ph_err is not NULL):
+            indices.append(i)
+            if node.p_fd_err is not NULL:
+                field_order = max(field_order, (node.p_fd_err.curr + 1) // 2)
+            if node.p_ph_err is not NULL:
+                phase_order = max(phase_order, (node.p_ph_err.curr + 1) // 2)
+    cdef int count = len(indices)
+    num_align = len(AlignError._fields)
+    align = np.zeros((count, num_align))
+    field = np.zeros((count, 2 * field_order))
+    phase = np.zeros((count, 2 * phase_order))
+    cdef double[:, :] align_view = align
+    cdef double[:, :] field_view = field
+    cdef double[:, :] phase_view = phase
+    for j in range(count):
+        node = seq.all_nodes[<int> indices[j]]
+        if node.p_al_err is not NULL:
+            for k in range(min(node.p_al_err.curr, num_align)):
+                align_view[j, k] = node.p_al_err.a[k]
+        if node.p_fd_err is not NULL:
+            for k in range(node.p_fd_err.curr):
+                field_view[j, k] = node.p_fd_err.a[k]
+        if node.p_ph_err is not NULL:
+            for k in range(node.p_ph_err.curr):
+                phase_view[j, k] = node.p_ph_err.a[k]
+    return {
+        'index': np.array(indices, dtype=int),
+        'name': np.array([_node_name(seq.all_nodes[i]) for i in indices],
+                         dtype=str),
+        'align': align,
+        'dkn': field[:, 0::2].copy(),
+        'dks': field[:, 1::2].copy(),
+        'dpn': phase[:, 0::2].copy(),
+        'dps': phase[:, 1::2].copy(),
+    }
+
+
 def get_global_element(element_index: int) -> dict:
     """
     Return requested element in the expanded sequence.
@@ -874,6 +1174,24 @@ def get_global_element_index(element_name: str) -> int:
     return clib.name_list_pos(_element_name, clib.element_list.list)
 
 
+def get_global_element_base_types(element_names) -> list:
+    """
+    Return the base type names of global elements.
+
+    :param list element_names: element names
+    :returns: the base type name of every element, or ``None`` if there is
+              no element with that name
+    """
+    cdef clib.el_list* elems = clib.element_list
+    cdef int index
+    result = []
+    for name in element_names:
+        index = clib.name_list_pos(_cstr(name.lower()), elems.list)
+        result.append(None if index < 0 else
+                      _str(elems.elem[index].base_type.name))
+    return result
+
+
 def get_global_element_count() -> int:
     """
     Return number of globally visible elements.
@@ -1185,6 +1503,75 @@ cdef dict _get_node(clib.node* node, int ref_flag, int is_expanded, int line):
     return data
 
 
+cdef dict _get_expanded_index(clib.sequence* seq, str sequence_name):
+    """
+    Return the index of every node name in the expanded sequence.
+
+    There is no name_list for the expanded sequence in MAD-X, so we build
+    a dict once and keep it until the sequence is expanded again, or any
+    input other than assignments has been executed, see :func:`input`.
+    """
+    cdef int i
+    state = (<size_t> seq, <size_t> seq.all_nodes, seq.n_nodes)
+    cached = _expanded_indices.get(sequence_name)
+    if cached is None or cached[0] != state:
+        # iterate backwards, so the first node with a given name wins:
+        index = {<bytes> seq.all_nodes[i].name: i
+                 for i in range(seq.n_nodes - 1, -1, -1)}
+        cached = _expanded_indices[sequence_name] = (state, index)
+    return cached[1]
+
+
+cdef tuple _get_position_index(clib.sequence* seq, str sequence_name,
+                               bint expanded):
+    """
+    Return arrays with the entry and exit positions of all nodes of the
+    original or expanded sequence, and whether both are sorted.
+
+    The arrays are kept until the node list is reallocated or resized, or
+    any input other than assignments has been executed, see :func:`input`.
+    """
+    cdef clib.node** nodes = seq.all_nodes if expanded else seq.nodes.nodes
+    cdef int count = seq.n_nodes if expanded else seq.nodes.curr
+    cdef int i
+    cdef double[:] entry_view
+    cdef double[:] exit_view
+    state = (<size_t> seq, <size_t> nodes, count, seq.n_nodes)
+    cached = _position_indices.get((sequence_name, expanded))
+    if cached is None or cached[0] != state:
+        entry = np.empty(count)
+        exit = np.empty(count)
+        entry_view = entry
+        exit_view = exit
+        for i in range(count):
+            entry_view[i] = _get_node_entry_pos(
+                nodes[i], seq.ref_flag, seq.n_nodes > 0)
+            exit_view[i] = entry_view[i] + nodes[i].length
+        is_sorted = bool(np.all(entry[1:] >= entry[:-1]) and
+                         np.all(exit[1:] >= exit[:-1]))
+        cached = _position_indices[sequence_name, expanded] = (
+            state, (entry, exit, is_sorted))
+    return cached[1]
+
+
+cdef _find_positions(tuple position_index, positions):
+    """Return the index of the first node with ``entry <= pos <= exit`` for
+    every position, or -1 if there is none."""
+    entry, exit, is_sorted = position_index
+    positions = np.asarray(positions, dtype=float)
+    if is_sorted:
+        # first node that ends after the position, if it starts before:
+        first = np.searchsorted(exit, positions, side='left')
+        stop = np.searchsorted(entry, positions, side='right')
+        return np.where(first < stop, first, -1)
+    result = np.full(positions.shape, -1, dtype=int)
+    for i, pos in np.ndenumerate(positions):
+        found = np.flatnonzero((entry <= pos) & (pos <= exit))
+        if len(found):
+            result[i] = found[0]
+    return result
+
+
 cdef double [:] _memview(clib.double_array* array):
     return <double [:array.curr]> array.a
 
@@ -1228,6 +1615,90 @@ cdef clib.variable* _get_var(name) except NULL:
     return var
 
 
+cdef _invalidate_tables(names):
+    """Start a new generation for the tables in ``names``, or for all tables
+    if ``names`` is ``None``. Forget deleted tables."""
+    global _table_generation
+    _table_generation += 1
+    existing = set(get_table_names())
+    if names is None:
+        names = existing
+    for cache in (_table_generations, _selected_rows):
+        for name in list(cache):
+            if name not in existing:
+                del cache[name]
+    for name in names:
+        _table_generations[name] = _table_generation
+
+
+cdef _get_table_row_indices(clib.table* table, rows):
+    """Return row indices for ``rows`` in ``table``, which is either a list
+    of indices, a slice, or ``'all'`` or ``'selected'``. Ranges with positive
+    step are returned as slice, so they can be used for indexing numpy arrays
+    without copying."""
+    if isinstance(rows, str):
+        if rows == 'all':
+            return slice(0, table.curr)
+        elif rows == 'selected':
+            return _get_table_selected_rows(table, _str(table.name))
+        else:
+            raise ValueError("Invalid value for rows:", rows)
+    if isinstance(rows, slice):
+        rows = range(table.curr)[rows]
+        if rows.step > 0:
+            return slice(rows.start, rows.stop, rows.step)
+    return np.arange(table.curr)[rows]
+
+
+cdef _get_table_row_flags(clib.table* table):
+    """Return the row selection flags of the table as numpy array (without
+    copying)."""
+    if table.curr == 0:
+        return np.zeros(0, dtype=np.intc)
+    return np.asarray(<int[:table.curr]> table.row_out.i)
+
+
+cdef _get_table_selected_rows(clib.table* table, table_name):
+    """Return the selected row indices as numpy array. The result is cached
+    until the table is modified and must not be changed by the caller."""
+    generation = get_table_generation(table_name)
+    cached = _selected_rows.get(table_name)
+    if cached is None or cached[0] != generation:
+        rows = np.flatnonzero(_get_table_row_flags(table))
+        cached = _selected_rows[table_name] = (generation, rows)
+    return cached[1]
+
+
+cdef _iter_row_indices(clib.table* table, indices):
+    """Return a sized iterable over indices returned by
+    :func:`_get_table_row_indices`."""
+    if isinstance(indices, slice):
+        return range(table.curr)[indices]
+    return indices
+
+
+cdef _get_string_column(char** column, rows, bint compact):
+    """Return the strings at the given row indices, either as numpy array, or
+    as :class:`~cpymad.types.Categorical`. Every distinct value is decoded
+    only once."""
+    cdef Py_ssize_t n = 0
+    codes = np.empty(len(rows), dtype=np.intc)
+    cdef int[:] codes_view = codes
+    lookup = {}
+    for k in rows:
+        value = <bytes> column[k] if column[k] is not NULL else b""
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(lookup)
+        codes_view[n] = code
+        n += 1
+    categories = np.array([value.decode('utf-8') for value in lookup],
+                          dtype=str)
+    if compact:
+        return Categorical(codes, categories)
+    return categories[codes]
+
+
 cdef void _strip_comments(char* text) nogil:
     cdef char* dest = text
     cdef char c, d
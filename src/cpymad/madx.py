@@ -8,8 +8,8 @@ from __future__ import absolute_import
 
 from contextlib import contextmanager, suppress
 from functools import wraps
-from itertools import product
-from numbers import Number
+from itertools import groupby
+from numbers import Integral, Number, Real
 import collections.abc as abc
 import os
 import subprocess
@@ -18,8 +18,10 @@ import sys
 import numpy as np
 
 from . import _rpc
+from . import _shm
 from . import util
 from .stream import AsyncReader, TextCallback
+from .types import Categorical
 
 
 __all__ = [
@@ -132,7 +134,10 @@ class Madx:
     """
 
     def __init__(self, libmadx=None, command_log=None, stdout=None,
-                 history=None, prompt=None, **Popen_args):
+                 history=None, prompt=None, shared_memory=False,
+                 inprocess=False, stats_callback=None, recover=None,
+                 timeout=None, replay_timeout=None, _service=None,
+                 **Popen_args):
         """
         Initialize instance variables.
 
@@ -140,6 +145,16 @@ class Madx:
         :param command_log: Log all MAD-X commands issued via cpymad.
         :param stdout: file descriptor, file object or callable
         :param str prompt: prefix for a new :class:`CommandLog`
+        :param bool shared_memory: transfer numeric table columns via shared
+                                   memory rather than through the pipe
+        :param bool inprocess: load MAD-X into the current process
+        :param stats_callback: called after every call to libmadx, see
+                               :meth:`stats`
+        :param str recover: restart MAD-X after crashes: ``None``, ``'raise'``
+                            or ``'retry'``
+        :param float timeout: default timeout in seconds for all calls
+        :param float replay_timeout: timeout in seconds for restarting MAD-X
+                                     and replaying the inputs after a crash
         :param Popen_args: Additional parameters to ``subprocess.Popen``
 
         If ``libmadx`` is NOT specified, a new MAD-X interpreter will
@@ -154,6 +169,36 @@ class Madx:
                 m = Madx(stdout=f)
 
             m = Madx(stdout=sys.stdout)
+
+        With ``shared_memory=True``, numeric table columns are placed in
+        shared memory segments by the MAD-X process and mapped without copying
+        by the :class:`Table`. This can be significantly faster for large
+        tables. It is silently ignored on platforms where it is not supported
+        (windows).
+
+        With ``inprocess=True``, MAD-X is loaded directly into the python
+        process. This removes the IPC overhead of every call, but a crash in
+        MAD-X will terminate the python process. Only one such instance can
+        be created during the lifetime of a process, creating another one
+        raises a ``RuntimeError`` even after the first one has been closed.
+        Output can not be redirected in this mode. With some builds, importing
+        pandas or pyarrow after MAD-X has been loaded aborts the process, so
+        such modules must be imported beforehand.
+
+        With ``recover='raise'`` or ``recover='retry'``, a new MAD-X process is
+        spawned if the process crashes during :meth:`input`. All inputs that
+        completed before the crash are replayed in the new process (see
+        :meth:`checkpoint`), starting in the working directory that MAD-X had
+        initially. Then, the failed input is either retried once
+        (``'retry'``), or a ``RuntimeError`` is raised (``'raise'``). Objects
+        such as tables and sequences remain usable after recovery.
+
+        If a call to the MAD-X process does not complete within ``timeout``
+        seconds, the process is killed and a ``TimeoutError`` is raised. In
+        this case, the instance is unusable afterwards unless ``recover`` is
+        set. The timeout can be overriden for individual inputs, see
+        :meth:`input`. The restart and replay after a crash or timeout are
+        limited by ``replay_timeout`` instead, which is unlimited by default.
         """
         if isinstance(command_log, str):
             # open new history file:
@@ -166,7 +211,42 @@ class Madx:
                 "Passing fully constructed `command_log` instances is " \
                 "incompatible with parameter `prompt`."
             command_log = CommandLog(sys.stdout, prompt)
+        if recover not in (None, 'raise', 'retry'):
+            raise ValueError("Invalid value for recover: {!r}".format(recover))
+        if recover and (inprocess or libmadx is not None or
+                        _service is not None):
+            raise ValueError(
+                "recover is only supported for MAD-X in a subprocess.")
+        if timeout is not None and (inprocess or libmadx is not None):
+            raise ValueError(
+                "timeout is only supported for MAD-X in a subprocess.")
         self.reader = NullContext()
+        self._service = None
+        self._process = None
+        self._timeout = timeout
+        self._stats_callback = stats_callback
+        self._recover = recover
+        self._replay = [] if recover else None
+        self._replay_timeout = replay_timeout
+        if inprocess:
+            unsupported = sorted(Popen_args)
+            if libmadx is not None:
+                unsupported.append('libmadx')
+            if stdout is not None:
+                unsupported.append('stdout')
+            if unsupported:
+                raise ValueError(
+                    "Unsupported arguments for inprocess=True: {}".format(
+                        ', '.join(unsupported)))
+            self._service = libmadx = _rpc.LocalLibMadx()
+            self._service.stats_callback = stats_callback
+            shared_memory = False
+        # connect to an existing process, see fork():
+        if _service is not None:
+            self._service = _service
+            self._service.stats_callback = stats_callback
+            self._service.timeout = timeout
+            libmadx = _service.libmadx
         # start libmadx subprocess
         if libmadx is None:
             if stdout is None:
@@ -204,11 +284,10 @@ class Madx:
             # Therefore, we need set stdin=os.devnull by passing stdin=False:
             Popen_args.setdefault('stdin', False)
             Popen_args.setdefault('bufsize', 0)
-            self._service, self._process = \
-                _rpc.LibMadxClient.spawn_subprocess(**Popen_args)
+            self._stdout = stdout
+            self._Popen_args = Popen_args
+            self._spawn()
             libmadx = self._service.libmadx
-            if callable(stdout):
-                self.reader = AsyncReader(self._process.stdout, stdout)
         if not libmadx.is_started():
             with self.reader:
                 libmadx.start()
@@ -221,9 +300,62 @@ class Madx:
         self.elements = GlobalElementList(self)
         self.base_types = BaseTypeMap(self)
         self.sequence = SequenceMap(self)
-        self.table = TableMap(self._libmadx)
+        self.table = TableMap(self._libmadx, shared_memory=shared_memory)
         self._enter_count = 0
         self._batch = None
+        if self._replay is not None:
+            # The new process may be started in a different directory:
+            self._replay.append(util.format_command(
+                self.command.chdir, dir=libmadx.getcwd()))
+
+    def _spawn(self):
+        """Start a new libmadx subprocess."""
+        self._service, self._process = \
+            _rpc.LibMadxClient.spawn_subprocess(**self._Popen_args)
+        self._service.stats_callback = self._stats_callback
+        self._service.timeout = self._timeout
+        if callable(self._stdout):
+            self.reader = AsyncReader(self._process.stdout, self._stdout)
+
+    def _restart(self):
+        """Replace a crashed MAD-X process and replay the successful inputs
+        up to the crash."""
+        service = self._service
+        with suppress(RuntimeError, OSError):
+            service.close()
+        self._spawn()
+        self._service.stats = service.stats
+        self._libmadx._rebind(self._service)
+        try:
+            with self.reader, self._service.with_timeout(self._replay_timeout):
+                self._libmadx.start()
+                for is_input, items in groupby(
+                        self._replay, lambda item: isinstance(item, str)):
+                    if is_input:
+                        self._libmadx.input('\n'.join(items))
+                    else:
+                        for name, args in items:
+                            getattr(self._libmadx, name)(*args)
+        except (_rpc.RemoteProcessCrashed, TimeoutError):
+            raise RuntimeError(
+                "MAD-X has stopped working and could not be restarted!"
+            ) from None
+
+    def checkpoint(self):
+        """
+        Compact the list of inputs that are replayed when recovering from a
+        crash (see the ``recover`` parameter). Assignments of numbers that
+        are overwritten before executing any other command are removed.
+        """
+        if self._replay is not None:
+            self._replay[:] = [
+                compacted
+                for is_input, items in groupby(
+                    self._replay, lambda item: isinstance(item, str))
+                for compacted in (
+                    util.compact_assignments(list(items)) if is_input
+                    else items)
+            ]
 
     def __bool__(self):
         """Check if MAD-X is up and running."""
@@ -244,6 +376,7 @@ class Madx:
 
     def quit(self):
         """Shutdown MAD-X interpreter and stop process."""
+        self._recover = None
         with suppress(AttributeError, RuntimeError):
             self.input('quit;')
         with suppress(AttributeError, RuntimeError):
@@ -278,12 +411,14 @@ class Madx:
 
     # Methods:
 
-    def input(self, text: str) -> bool:
+    def input(self, text: str, timeout: float = None) -> bool:
         """
         Run any textual MAD-X input.
 
         :param text: command text
+        :param timeout: timeout in seconds, overrides the default timeout
         :returns: whether the command has completed without error
+        :raises TimeoutError: if the command does not complete in time
         """
         text = text.rstrip(';') + ';'
         if self._enter_count > 0:
@@ -291,18 +426,85 @@ class Madx:
             return True
         # write to history before performing the input, so if MAD-X
         # crashes, it is easier to see, where it happened:
+        if self.history is not None:
+            self.history.append(text)
+        if self._command_log:
+            self._command_log(text)
+        try:
+            with self.reader, self._with_timeout(timeout):
+                result = self._libmadx.input(text)
+        except _rpc.RemoteProcessCrashed:
+            if not self._recover:
+                raise RuntimeError("MAD-X has stopped working!") from None
+            return self._recover_input(text, timeout)
+        except TimeoutError:
+            if self._recover:
+                self._restart()
+            raise
+        if self._replay is not None:
+            self._replay.append(text)
+        return result
+
+    def _set_vars(self, values: dict):
+        """
+        Assign numeric values to global variables in a single call that
+        bypasses the MAD-X parser, see :func:`cpymad.libmadx.set_vars`. The
+        equivalent input is recorded in the history, the command log and for
+        crash recovery. In batch mode, the input is appended to the batch.
+        """
+        text = util._format_assignments(values)
+        if self._enter_count > 0:
+            self.input(text)
+            return
         if self.history is not None:
             self.history.append(text)
         if self._command_log:
             self._command_log(text)
         try:
             with self.reader:
-                return self._libmadx.input(text)
+                self._libmadx.set_vars(
+                    list(values), np.array(list(values.values()), dtype=float))
         except _rpc.RemoteProcessCrashed:
-            raise RuntimeError("MAD-X has stopped working!") from None
+            if not self._recover:
+                raise RuntimeError("MAD-X has stopped working!") from None
+            self._recover_input(text)
+            return
+        except TimeoutError:
+            if self._recover:
+                self._restart()
+            raise
+        if self._replay is not None:
+            self._replay.append(text)
+
+    def _recover_input(self, text: str, timeout: float = None) -> bool:
+        """Restart MAD-X after a crash during input, and retry if requested."""
+        self._restart()
+        if self._recover == 'retry':
+            try:
+                with self.reader, self._with_timeout(timeout):
+                    result = self._libmadx.input(text)
+            except _rpc.RemoteProcessCrashed:
+                self._restart()
+            except TimeoutError:
+                self._restart()
+                raise
+            else:
+                self._replay.append(text)
+                return result
+        raise RuntimeError(
+            "MAD-X has stopped working! It was restarted and the state before "
+            "the failed input was restored.")
 
     __call__ = input
 
+    def _with_timeout(self, timeout):
+        if timeout is None:
+            return NullContext()
+        if not isinstance(self._service, _rpc.LibMadxClient):
+            raise ValueError(
+                "timeout is only supported for MAD-X in a subprocess.")
+        return self._service.with_timeout(timeout)
+
     @contextmanager
     def batch(self):
         """
@@ -326,15 +528,65 @@ class Madx:
                 self.input("\n".join(self._batch))
                 self._batch = None
 
+    def fork(self, n: int = 1) -> list:
+        """
+        Create independent copies of this MAD-X interpreter by forking its
+        process. This is much faster than setting up a new interpreter from
+        scratch if loading the model takes a long time. Only available on
+        POSIX systems.
+
+        :param int n: number of copies
+        :returns: list of :class:`Madx` instances
+
+        The copies share the standard output of this instance's process and
+        have no command log, but inherit a copy of the ``history`` and the
+        ``shared_memory``, ``timeout`` and ``stats_callback`` settings.
+        Example:
+
+        >>> madx.call('lhc.madx')
+        >>> for seed, m in enumerate(madx.fork(8)):
+        ...     m.command.eoption(seed=seed)
+        """
+        return [self._fork() for _ in range(n)]
+
+    def stats(self, reset: bool = False) -> dict:
+        """
+        Get statistics about the calls to libmadx in the MAD-X process.
+
+        :param bool reset: clear the statistics
+        :returns: :class:`~cpymad._rpc.CallStats` by libmadx function name
+
+        The ``compute_time`` is the time spent executing the function in the
+        MAD-X process, the remainder of the ``wall_time`` is spent for
+        serialization and communication.
+
+        A ``stats_callback`` passed to the constructor is invoked after every
+        call as ``stats_callback(name, wall_time, compute_time, bytes_sent,
+        bytes_received)``.
+        """
+        service = getattr(self, '_service', None)
+        stats = getattr(service, 'stats', {})
+        result = dict(stats)
+        if reset:
+            stats.clear()
+        return result
+
+    def _fork(self) -> "Madx":
+        history = None if self.history is None else list(self.history)
+        return Madx(
+            _service=self._service.fork(), history=history,
+            shared_memory=self.table._shared_memory,
+            stats_callback=self._stats_callback, timeout=self._timeout)
+
     def expr_vars(self, expr: str) -> list:
         """Find all variable names used in an expression. This does *not*
         include element attribute nor function names."""
         if not isinstance(expr, str):
             return []
-        return [v for v in util.expr_symbols(expr)
-                if util.is_identifier(v)
-                and v in self.globals
-                and self._libmadx.get_var_type(v) > 0]
+        names = [v for v in util.expr_symbols(expr) if util.is_identifier(v)]
+        with _rpc.pipeline(self._libmadx) as libmadx:
+            types = [libmadx.get_var_type(v) for v in names]
+        return [v for v, t in zip(names, types) if _var_type(t) > 0]
 
     def chdir(self, dir: str) -> util.ChangeDirectory:
         """
@@ -382,7 +634,7 @@ class Madx:
             raise TwissFailed()
         table = kwargs.get('table', 'twiss')
         if 'file' not in kwargs:
-            self._libmadx.apply_table_selections(table)
+            self._apply_table_selections(table)
         return self.table[table]
 
     def survey(self, **kwargs):
@@ -395,9 +647,16 @@ class Madx:
         self.command.survey(**kwargs)
         table = kwargs.get('table', 'survey')
         if 'file' not in kwargs:
-            self._libmadx.apply_table_selections(table)
+            self._apply_table_selections(table)
         return self.table[table]
 
+    def _apply_table_selections(self, table: str):
+        """Restrict the table to the rows selected for it, and record this
+        for crash recovery."""
+        self._libmadx.apply_table_selections(table)
+        if self._replay is not None:
+            self._replay.append(('apply_table_selections', (table,)))
+
     def use(self, sequence: str = None, range: str = None, **kwargs):
         """
         Run USE to expand a sequence.
@@ -422,18 +681,16 @@ class Madx:
     def sectortable(self, name='sectortable'):
         """Read sectormap + kicks from memory and return as Nx7x7 array."""
         tab = self.table[name]
-        cnt = len(tab['r11'])
-        return np.vstack((
-            np.hstack((tab.rmat(slice(None)),
-                       tab.kvec(slice(None)).reshape((6, 1, -1)))),
-            np.hstack((np.zeros((1, 6, cnt)),
-                       np.ones((1, 1, cnt)))),
-        )).transpose((2, 0, 1))
+        rmat = tab._matrix('r', (6, 6))
+        result = np.zeros((len(rmat), 7, 7))
+        result[:, :6, :6] = rmat
+        result[:, :6, 6] = tab._matrix('k', (6,))
+        result[:, 6, 6] = 1
+        return result
 
     def sectortable2(self, name='sectortable'):
         """Read 2nd order sectormap T_ijk, return as Nx6x6x6 array."""
-        tab = self.table[name]
-        return tab.tmat(slice(None)).transpose((3, 0, 1, 2))
+        return self.table[name]._matrix('t', (6, 6, 6))
 
     def match(self,
               constraints=[],
@@ -605,15 +862,17 @@ class TableMap(_Mapping):
 
     """Mapping of all tables (:class:`Table`) in memory."""
 
-    def __init__(self, libmadx):
+    def __init__(self, libmadx, *, shared_memory=False):
         self._libmadx = libmadx
+        self._shared_memory = shared_memory
 
     def __iter__(self):
         return iter(self._libmadx.get_table_names())
 
     def __getitem__(self, name):
         try:
-            return Table(name, self._libmadx)
+            return Table(name, self._libmadx,
+                         shared_memory=self._shared_memory)
         except ValueError:
             raise KeyError("Table not found {!r}".format(name)) from None
 
@@ -667,7 +926,8 @@ class Sequence:
     @property
     def twiss_table(self):
         """Get the TWISS results from the last calculation."""
-        return Table(self.twiss_table_name, self._libmadx)
+        return Table(self.twiss_table_name, self._libmadx,
+                     shared_memory=self._madx.table._shared_memory)
 
     @property
     def twiss_table_name(self):
@@ -705,6 +965,86 @@ class Sequence:
     def expanded_element_positions(self):
         return self._libmadx.get_expanded_element_positions(self._name)
 
+    def element_table(self, attrs=(), *, expanded=False, expressions=False):
+        """
+        Get the attributes of all elements as columns with a single call.
+
+        :param list attrs: names of numeric element attributes, e.g. ``k1``
+        :param bool expanded: use the expanded sequence including implicit
+                              drifts
+        :param bool expressions: add the columns ``<attr>_expr`` with the
+                                 expressions of the attributes
+        :returns: arrays ``name``, ``base_type``, ``parent``, ``position``,
+                  ``length`` and the requested attributes
+
+        This is much faster than iterating over :attr:`elements` for large
+        sequences. Attributes that are not defined for an element are NaN.
+        """
+        return AttrDict(self._libmadx.get_element_table(
+            self._name, attrs, expanded=expanded, expressions=expressions))
+
+    def set_attribute(self, attr, names, values) -> bool:
+        """
+        Set an attribute of many elements with a single MAD-X input, e.g. the
+        strengths of all correctors::
+
+            seq.set_attribute('kick', names, kicks)
+
+        :param str attr: attribute name
+        :param names: element names. The occurrence suffix of repeated
+                      elements (e.g. ``qp[2]``) is ignored, since attributes
+                      are shared by all occurrences of an element.
+        :param values: array of values, or a single value for all elements
+        :returns: whether the input has completed without error
+        :raises KeyError: if an element is not in the sequence
+        :raises ValueError: if the number of values does not match, or if
+                            different values are given for the same element
+        """
+        names = [util._parse_element_name(name)[0].lower() for name in names]
+        if isinstance(values, (str, Number)):
+            values = [values] * len(names)
+        elif isinstance(values, np.ndarray):
+            values = values.tolist()
+        if len(values) != len(names):
+            raise ValueError(
+                "Got {} values for {} elements.".format(len(values), len(names)))
+        updates = {}
+        for name, value in zip(names, values):
+            if updates.setdefault(name, value) != value:
+                raise ValueError(
+                    "Conflicting values for element {!r}: {!r} and {!r}."
+                    .format(name, updates[name], value))
+        # Check membership with a single request, considering elements of
+        # subsequences as well, if the sequence is expanded:
+        with _rpc.pipeline(self._libmadx) as libmadx:
+            found = [
+                (name,
+                 libmadx.get_element_index(self._name, name),
+                 libmadx.get_expanded_element_index(self._name, name))
+                for name in updates
+            ]
+        for name, index, expanded_index in found:
+            if index.exception() and expanded_index.exception():
+                raise KeyError("Element {!r} is not in sequence {!r}."
+                               .format(name, self._name))
+        return self._madx.elements.update_many({
+            name: {attr: value}
+            for name, value in updates.items()
+        })
+
+    def error_arrays(self):
+        """
+        Get the errors assigned to the nodes of the expanded sequence (e.g.
+        by EALIGN and EFCOMP) as arrays with a single call.
+
+        :returns: arrays ``index`` and ``name`` of the nodes that have errors,
+                  the (N, 14) matrix ``align`` with the columns of
+                  :class:`~cpymad.types.AlignError`, and the matrices ``dkn``,
+                  ``dks``, ``dpn`` and ``dps``, padded with zeros up to the
+                  highest order.
+        """
+        return AttrDict(self._libmadx.get_error_arrays(self._name))
+
     @property
     def is_expanded(self):
         """Check if sequence is already expanded."""
@@ -955,6 +1295,8 @@ class BaseElementList:
 
 class ElementList(BaseElementList, abc.Sequence):
 
+    _expanded = False
+
     def __init__(self, madx, sequence_name):
         """
         Initialize instance.
@@ -967,6 +1309,17 @@ class ElementList(BaseElementList, abc.Sequence):
         """Find the element at specified S position."""
         return self._get_element_at(pos)
 
+    def at_many(self, positions) -> np.ndarray:
+        """
+        Find the elements at many S positions with a single call.
+
+        :param positions: array of S positions
+        :returns: integer array with the element index for every position,
+                  or -1 where there is no element
+        """
+        return self._libmadx.get_element_indices_by_position(
+            self._sequence_name, positions, expanded=self._expanded)
+
     def _get_element(self, element_index):
         return self._libmadx.get_element(self._sequence_name, element_index)
 
@@ -986,6 +1339,8 @@ class ElementList(BaseElementList, abc.Sequence):
 
 class ExpandedElementList(ElementList):
 
+    _expanded = True
+
     def _get_element(self, element_index):
         return self._libmadx.get_expanded_element(
             self._sequence_name, element_index)
@@ -1018,11 +1373,42 @@ class GlobalElementList(BaseElementList, _Mapping):
         self._get_element_index = libmadx.get_global_element_index
 
     def __iter__(self):
-        return iter(map(self._libmadx.get_global_element_name, range(len(self))))
+        with _rpc.pipeline(self._libmadx) as libmadx:
+            names = [libmadx.get_global_element_name(i)
+                     for i in range(len(self))]
+        return (name.result() for name in names)
 
     def __repr__(self):
         return '{{{}}}'.format(', '.join(self))
 
+    def update_many(self, updates: dict) -> bool:
+        """
+        Set attributes of many elements with a single MAD-X input, e.g.::
+
+            madx.elements.update_many({
+                'qf': {'k1': 0.3},
+                'qd': {'k1': -0.3, 'tilt': 'qd_tilt'},
+            })
+
+        :param dict updates: attribute values by attribute name, by element
+                             name. Values may be numpy scalars or arrays.
+        :returns: whether the input has completed without error
+        :raises KeyError: if an element does not exist
+        """
+        names = [name.lower() for name in updates]
+        base_types = self._madx._libmadx.get_global_element_base_types(names)
+        commands = []
+        for name, base_type, attrs in zip(names, base_types, updates.values()):
+            if base_type is None:
+                raise KeyError("Unknown element: {!r}".format(name))
+            # elements have the same attribute types as their base type:
+            base = self._madx.base_types[base_type]
+            commands.append(', '.join(filter(None, [name] + [
+                util.format_cmdpar(base, key, attrs[key])
+                for key in util.ordered_keys(attrs)
+            ])) + ';')
+        return self._madx.input('\n'.join(commands))
+
 
 def cached(func):
     @wraps(func)
@@ -1083,15 +1469,26 @@ class Table(_Mapping):
     MAD-X twiss table.
 
     Loads individual columns from the MAD-X process lazily only on demand.
+    Cached columns are discarded automatically when the table is modified
+    in MAD-X, e.g. by running TWISS again, so it is safe to keep the same
+    object around.
+
+    If ``shared_memory`` is enabled, numeric columns are mapped from shared
+    memory segments without copying. The memory is released automatically
+    when the table and all arrays obtained from it have been deleted.
     """
 
-    def __init__(self, name, libmadx, *, columns='all', rows='all', _check=True):
+    def __init__(self, name, libmadx, *, columns='all', rows='all',
+                 shared_memory=False, _check=True):
         """Just store the table name for now."""
         self._name = name = name.lower()
         self._libmadx = libmadx
         self._columns = columns
         self._rows = rows
+        self._shared_memory = shared_memory and _shm.available
         self._cache = {}
+        self._generation = None
+        self._modified = None
         if _check and not libmadx.table_exists(name):
             raise ValueError("Invalid table: {!r}".format(name))
 
@@ -1112,17 +1509,35 @@ class Table(_Mapping):
         return Table(
             self._name, self._libmadx,
             columns=columns, rows=rows,
+            shared_memory=self._shared_memory,
             _check=False)
 
     def __getitem__(self, column):
         """Get the column data."""
         if isinstance(column, int):
             return self.row(column)
+        self._check_cache()
         try:
             return self._cache[column.lower()]
         except KeyError:
             return self.reload(column)
 
+    def _check_cache(self):
+        """Discard cached columns if the table has been modified in MAD-X."""
+        # Ask MAD-X only if any call since the last check may have modified
+        # tables, if this is tracked by the libmadx wrapper:
+        modified = getattr(self._libmadx, 'modified', None)
+        if modified is not None and modified == self._modified:
+            return
+        self._modified = modified
+        try:
+            generation = self._libmadx.get_table_generation(self._name)
+        except ValueError:      # table was deleted
+            generation = None
+        if generation != self._generation or generation is None:
+            self._cache.clear()
+            self._generation = generation
+
     def __iter__(self):
         """Iterate over all column names."""
         return iter(self.col_names())
@@ -1196,7 +1611,13 @@ class Table(_Mapping):
         """
         if rows is None:
             rows = self._rows
-        return self._libmadx.get_table_column(self._name, column.lower(), rows)
+        return _expand_strings(_shm.attach_array(
+            self._libmadx.get_table_column(
+                self._name, column.lower(), rows, compact=True,
+                **self._fetch_args())))
+
+    def _fetch_args(self):
+        return {'shared': True} if self._shared_memory else {}
 
     def row(self, index, columns=None):
         """Retrieve one row from the table."""
@@ -1209,16 +1630,76 @@ class Table(_Mapping):
         Return a frozen table with the desired columns.
 
         :param list columns: column names or ``None`` for all columns.
+        :param rows: row indices or 'all' or 'selected'
         :returns: column data
         :raises ValueError: if the table name is invalid
         """
+        return {
+            column: _expand_strings(data)
+            for column, data in self._copy(columns, rows).items()
+        }
+
+    def _copy(self, columns=None, rows=None) -> dict:
+        """Same as :meth:`copy`, but string columns that are not cached are
+        returned as :class:`~cpymad.types.Categorical`."""
         if rows is None:
             rows = columns if isinstance(columns, str) else self._rows
         if rows == self._rows:
-            table = self
+            self._check_cache()
+            cache = self._cache
+        else:
+            cache = None
+        columns = self.col_names(columns)
+        fetched = {}
+        missing = [column.lower() for column in columns
+                   if cache is None or column.lower() not in cache]
+        if missing:
+            try:
+                names, data, strings = self._libmadx.get_table_columns(
+                    self._name, missing, rows, compact=True,
+                    **self._fetch_args())
+            except ValueError as e:
+                raise KeyError(str(e)) from None
+            fetched.update(zip(names, _shm.attach_array(data)))
+            fetched.update(strings)
+            if cache is not None:
+                cache.update({
+                    column: _expand_strings(data)
+                    for column, data in fetched.items()
+                })
+        data = fetched if cache is None else cache
+        return {column: data[column.lower()] for column in columns}
+
+    def iter_chunks(self, columns=None, chunk_rows=100000):
+        """
+        Iterate over consecutive ranges of rows of the table.
+
+        :param columns: column names or 'all' or 'selected'
+        :param int chunk_rows: maximum number of rows per chunk
+        :returns: iterator over dicts of column data
+
+        Chunks are fetched lazily, so that the memory usage is bounded by
+        the chunk size rather than the table size. The table should not be
+        modified during the iteration.
+        """
+        if chunk_rows < 1:
+            raise ValueError("chunk_rows must be >= 1.")
+        columns = [column.lower() for column in self.col_names(columns)]
+        rows = self._rows
+        if isinstance(rows, str) and rows == 'all':
+            count = self._libmadx.get_table_row_count(self._name)
+            chunks = (slice(start, start + chunk_rows)
+                      for start in range(0, count, chunk_rows))
         else:
-            table = self.select(rows=rows)
-        return {column: table[column] for column in self.col_names(columns)}
+            if isinstance(rows, str) and rows == 'selected':
+                rows = self.selected_rows()
+            else:
+                count = self._libmadx.get_table_row_count(self._name)
+                rows = np.arange(count)[rows].tolist()
+            chunks = (rows[start:start + chunk_rows]
+                      for start in range(0, len(rows), chunk_rows))
+        for chunk in chunks:
+            yield self.copy(columns, chunk)
 
     def dframe(self, columns=None, rows=None, *, index=None):
         """
@@ -1231,6 +1712,8 @@ class Table(_Mapping):
         :returns: column data as ``pandas.DataFrame``
         :raises ValueError: if the table name is invalid
 
+        String columns are returned as ``pandas.Categorical``.
+
         WARNING: using ``index=None`` is unsafe after calling ``USE``.
         In this case, please manually specify another column to be used,
         e.g. ``index="name"``.
@@ -1239,17 +1722,60 @@ class Table(_Mapping):
         if index is None:
             index = self.row_names(rows)
         elif isinstance(index, str):
-            index = util.remove_count_suffix_from_name(self[index])
-        else:
-            index = index
-        return pd.DataFrame(self.copy(columns, rows), index=index)
+            index = _expand_strings(util.remove_count_suffix_from_name(
+                self._copy([index], rows)[index]))
+        return pd.DataFrame({
+            column: _to_categorical(pd, data)
+            for column, data in self._copy(columns, rows).items()
+        }, index=index)
+
+    def to_arrow(self, columns=None, rows=None):
+        """
+        Return table as ``pyarrow.Table``. Requires ``pyarrow``.
+
+        :param columns: column names or 'all' or 'selected'
+        :param rows: row indices or 'all' or 'selected'
+        :returns: column data as ``pyarrow.Table``
+
+        The columns ``name`` and ``keyword`` are dictionary encoded and the
+        table summary is stored as schema metadata.
+        """
+        from . import _arrow
+        return _arrow.to_arrow(self._copy(columns, rows), self.summary)
+
+    def to_parquet(self, path, columns=None, rows=None, **kwargs):
+        """
+        Write table to a parquet file. Requires ``pyarrow``.
+
+        :param str path: file name
+        :param columns: column names or 'all' or 'selected'
+        :param rows: row indices or 'all' or 'selected'
+        :param kwargs: passed to ``pyarrow.parquet.write_table``
+
+        See :meth:`to_arrow` for the format.
+        """
+        from . import _arrow
+        _arrow.write_parquet(
+            path, self._copy(columns, rows), self.summary, **kwargs)
 
     def getmat(self, name, idx, *dim):
-        s = () if isinstance(idx, int) else (-1,)
-        return np.array([
-            self[name + ''.join(str(i+1) for i in ijk)][idx]
-            for ijk in product(*map(range, dim))
-        ]).reshape(dim+s)
+        rows = self._rows
+        if isinstance(idx, Integral) and isinstance(rows, str) and \
+                rows == 'all':
+            rows, idx = [idx], 0
+        data = self._matrix(name, dim, rows)[idx]
+        return data if isinstance(idx, Integral) else np.moveaxis(data, 0, -1)
+
+    def _matrix(self, name, dims, rows=None):
+        """Retrieve the matrix stored in the columns ``name<i><j>…`` with
+        shape ``(len(rows),) + dims``."""
+        if rows is None:
+            rows = self._rows
+        try:
+            return _shm.attach_array(self._libmadx.get_table_matrix(
+                self._name, name, dims, rows, **self._fetch_args()))
+        except ValueError as e:
+            raise KeyError(str(e)) from None
 
     def kvec(self, idx, dim=6):
         """Kicks."""
@@ -1268,6 +1794,32 @@ class Table(_Mapping):
         return self.getmat('sig', idx, dim, dim)
 
 
+def _var_type(future) -> int:
+    """Get the result of ``get_var_type``, or -1 for undefined variables."""
+    try:
+        return future.result()
+    except KeyError:
+        return -1
+
+
+def _expand_strings(data):
+    """Convert :class:`~cpymad.types.Categorical` to a string array, pass
+    through other values."""
+    if isinstance(data, Categorical):
+        return data.categories[data.codes]
+    return data
+
+
+def _to_categorical(pd, data):
+    """Convert string data to ``pandas.Categorical``, pass through other
+    values."""
+    if isinstance(data, Categorical):
+        return pd.Categorical.from_codes(data.codes, data.categories)
+    if data.dtype.kind == 'U':
+        return pd.Categorical(data)
+    return data
+
+
 class VarList(_MutableMapping):
 
     """Mapping of global MAD-X variables."""
@@ -1301,6 +1853,32 @@ class VarList(_MutableMapping):
             if value != e:
                 self._madx.input(name + ' := ' + str(value) + ';')
 
+    def update(*args, **kwargs):
+        """
+        Set many variables. Numeric values are assigned in a single call
+        without invoking the MAD-X parser, other values are set as deferred
+        expressions like with ``madx.globals[name] = value``.
+
+        :raises TypeError: if a value is a complex number
+        """
+        self, args = args[0], args[1:]
+        values = dict(*args, **kwargs)
+        for name, value in values.items():
+            if isinstance(value, Number) and not isinstance(value, Real):
+                raise TypeError(
+                    "Can't assign non-real number to {!r}: {!r}"
+                    .format(name, value))
+        numeric = {
+            name.lower(): value
+            for name, value in values.items()
+            if isinstance(value, Real) and not isinstance(value, bool)
+        }
+        if numeric:
+            self._madx._set_vars(numeric)
+        for name, value in values.items():
+            if name.lower() not in numeric:
+                self[name] = value
+
     def __delitem__(self, name):
         raise NotImplementedError("Can't erase a MAD-X global.")
 
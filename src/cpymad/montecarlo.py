@@ -0,0 +1,223 @@
+"""
+Parallel Monte Carlo runs over error seeds.
+
+For every seed, a worker re-expands the sequence (which removes previously
+assigned errors), sets the seed with ``EOPTION``, executes an error
+assignment script and runs TWISS. Only the requested columns are sent back,
+and the parent process merges them into running statistics, so that the
+per-seed tables never need to be kept in memory::
+
+    from cpymad.montecarlo import run
+
+    stats = run(
+        setup='call, file="lattice.madx";',
+        sequence='ring',
+        errors='''
+            select, flag=error, class=quadrupole;
+            ealign, dx:=1e-4*tgauss(3), dy:=1e-4*tgauss(3);
+        ''',
+        seeds=range(1000),
+        columns=['x', 'y', 'betx'],
+        percentiles=[5, 95],
+    )
+    print(stats['x'].mean, stats['x'].std, stats['x'].percentile(95))
+"""
+
+from concurrent.futures import FIRST_COMPLETED, wait
+from functools import partial
+from itertools import islice
+from string import Template
+import os
+
+import numpy as np
+
+from .executor import MadxExecutor, _chunks
+
+
+__all__ = [
+    'OnlineStats',
+    'run',
+]
+
+
+def run(setup, sequence: str, errors, seeds, columns, *,
+        twiss: dict = None, percentiles=(), max_workers: int = None,
+        chunksize: int = 1, callback=None, **madx_args) -> dict:
+    """
+    Run TWISS for many error seeds in parallel and return statistics of the
+    requested table columns.
+
+    :param setup: MAD-X input (str) or function ``setup(madx)`` that loads the
+                  model in each worker
+    :param str sequence: name of the sequence
+    :param errors: error assignment script (str) or function
+                   ``errors(madx, seed)``. In the script, ``$seed`` is
+                   replaced by the seed number.
+    :param seeds: iterable of seeds (int)
+    :param list columns: names of numeric twiss columns
+    :param dict twiss: additional arguments for TWISS
+    :param percentiles: percentiles (0-100) to estimate for each column
+    :param int max_workers: number of worker processes
+    :param int chunksize: number of seeds that are sent to a worker at once
+    :param callback: called as ``callback(seed, data)`` with the column data
+                     of every seed as it arrives
+    :param madx_args: keyword arguments for :class:`~cpymad.madx.Madx`
+    :returns: :class:`OnlineStats` by column name
+
+    The columns have one entry per row of the twiss table.
+    """
+    columns = list(columns)
+    stats = {
+        column: OnlineStats(percentiles)
+        for column in columns
+    }
+    task = partial(
+        _run_seeds, sequence=sequence, errors=errors,
+        columns=columns, twiss=twiss or {})
+    with MadxExecutor(max_workers, setup, **madx_args) as executor:
+        chunks = _chunks(seeds, chunksize)
+        # Limit the number of pending chunks to avoid accumulating results:
+        window = 2 * (max_workers or os.cpu_count() or 1)
+        pending = {executor.submit(task, chunk)
+                   for chunk in islice(chunks, window)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for chunk in islice(chunks, len(done)):
+                pending.add(executor.submit(task, chunk))
+            for future in done:
+                for seed, data in future.result():
+                    for column in columns:
+                        stats[column].update(data[column])
+                    if callback is not None:
+                        callback(seed, data)
+    return stats
+
+
+def _run_seeds(madx, seeds, sequence, errors, columns, twiss):
+    """Compute the twiss columns for a chunk of seeds (in the worker)."""
+    results = []
+    for seed in seeds:
+        madx.use(sequence=sequence)
+        madx.command.eoption(seed=seed)
+        if isinstance(errors, str):
+            madx.input(Template(errors).safe_substitute(seed=seed))
+        else:
+            errors(madx, seed)
+        table = madx.twiss(sequence=sequence, **twiss)
+        results.append((seed, {
+            column: table[column]
+            for column in columns
+        }))
+    return results
+
+
+class OnlineStats:
+
+    """
+    Elementwise running statistics of a sequence of equally shaped arrays.
+
+    Mean and variance are computed with Welford's algorithm. Percentiles are
+    estimated with the P² algorithm (Jain and Chlamtac, 1985), which needs
+    only constant memory, but is approximate.
+
+    :param percentiles: percentiles (0-100) to estimate
+    """
+
+    def __init__(self, percentiles=()):
+        self.count = 0
+        self._percentiles = {p: _P2Quantile(p / 100) for p in percentiles}
+
+    def update(self, data):
+        """Add one sample array."""
+        data = np.asarray(data, dtype=float)
+        self.count += 1
+        if self.count == 1:
+            self._mean = data.copy()
+            self._m2 = np.zeros_like(data)
+            self.min = data.copy()
+            self.max = data.copy()
+        else:
+            delta = data - self._mean
+            self._mean += delta / self.count
+            self._m2 += delta * (data - self._mean)
+            np.minimum(self.min, data, out=self.min)
+            np.maximum(self.max, data, out=self.max)
+        for estimator in self._percentiles.values():
+            estimator.update(data)
+
+    @property
+    def mean(self) -> np.ndarray:
+        """Elementwise mean."""
+        return self._mean
+
+    @property
+    def var(self) -> np.ndarray:
+        """Elementwise (unbiased) sample variance."""
+        if self.count < 2:
+            return np.full_like(self._mean, np.nan)
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std(self) -> np.ndarray:
+        """Elementwise sample standard deviation."""
+        return np.sqrt(self.var)
+
+    def percentile(self, p) -> np.ndarray:
+        """Elementwise estimate for the percentile ``p``, which must have
+        been passed to the constructor."""
+        return self._percentiles[p].value
+
+
+class _P2Quantile:
+
+    """P² estimator for one quantile, vectorized over array elements."""
+
+    def __init__(self, p):
+        self.p = p
+        self._initial = []
+        self._q = None
+        self._dn = np.array([0, p / 2, p, (1 + p) / 2, 1])
+
+    @property
+    def value(self):
+        if self._q is None:
+            return np.percentile(self._initial, self.p * 100, axis=0)
+        return self._q[2]
+
+    def update(self, x):
+        # use exact percentiles until we have enough samples:
+        if self._q is None:
+            self._initial.append(x)
+            if len(self._initial) == 5:
+                p = self.p
+                self._q = np.sort(self._initial, axis=0)
+                self._n = np.zeros_like(self._q) + np.arange(5.0).reshape(
+                    (5,) + (1,) * x.ndim)
+                self._np = np.array([0, 2 * p, 4 * p, 2 + 2 * p, 4])
+                self._initial = None
+            return
+        q, n = self._q, self._n
+        np.minimum(q[0], x, out=q[0])
+        np.maximum(q[4], x, out=q[4])
+        k = (x >= q[1]).astype(int) + (x >= q[2]) + (x >= q[3])
+        for i in range(1, 5):
+            n[i] += k < i
+        self._np = self._np + self._dn
+        for i in range(1, 4):
+            d = self._np[i] - n[i]
+            d = np.where(
+                (d >= 1) & (n[i+1] - n[i] > 1), 1.0,
+                np.where((d <= -1) & (n[i-1] - n[i] < -1), -1.0, 0.0))
+            if not d.any():
+                continue
+            with np.errstate(divide='ignore', invalid='ignore'):
+                parabolic = q[i] + d / (n[i+1] - n[i-1]) * (
+                    (n[i] - n[i-1] + d) * (q[i+1] - q[i]) / (n[i+1] - n[i]) +
+                    (n[i+1] - n[i] - d) * (q[i] - q[i-1]) / (n[i] - n[i-1]))
+                j = np.where(d > 0, i + 1, i - 1)
+                qj = np.take_along_axis(q, j[None], 0)[0]
+                nj = np.take_along_axis(n, j[None], 0)[0]
+                linear = q[i] + d * (qj - q[i]) / (nj - n[i])
+            ok = (q[i-1] < parabolic) & (parabolic < q[i+1])
+            q[i] = np.where(d == 0, q[i], np.where(ok, parabolic, linear))
+            n[i] += d
@@ -0,0 +1,176 @@
+"""
+Pool of reusable MAD-X interpreters.
+
+Spawning a MAD-X process and initializing the interpreter takes a noticeable
+amount of time. Applications that create many short-lived :class:`Madx`
+instances (e.g. one per point of a parameter scan) can instead keep a number
+of started interpreters alive and borrow them as needed::
+
+    from cpymad.pool import MadxPool
+
+    with MadxPool(4, baseline='call, file="lattice.madx";') as pool:
+        with pool.acquire() as madx:
+            madx.globals.kqf = 0.01
+            twiss = madx.twiss(sequence='fodo')
+"""
+
+import os
+import queue
+import threading
+from contextlib import contextmanager, suppress
+
+from .madx import Madx
+
+
+__all__ = [
+    'MadxPool',
+]
+
+
+class MadxPool:
+
+    """
+    Keep a number of started MAD-X interpreters for reuse.
+
+    :param int size: number of interpreters to keep alive
+    :param str baseline: MAD-X input that is executed after starting an
+                         interpreter and replayed whenever it is returned to
+                         the pool
+    :param int max_tasks: replace an interpreter by a fresh one after it has
+                          been acquired this many times
+    :param int max_rss: replace an interpreter by a fresh one if its process
+                        uses more than this many bytes of resident memory
+    :param madx_args: keyword arguments for :class:`~cpymad.madx.Madx`
+
+    Note that MAD-X has no way to fully reset its state. Replaying the
+    ``baseline`` script restores everything it defines (variables, elements,
+    beam, etc), but other definitions made while the interpreter was
+    borrowed will persist. Use ``max_tasks=1`` if you need completely fresh
+    interpreters.
+
+    Interpreters that have crashed or been killed due to a ``timeout`` (see
+    :class:`~cpymad.madx.Madx`) are replaced automatically when returned.
+    """
+
+    def __init__(self, size: int, baseline: str = None, *,
+                 max_tasks: int = None, max_rss: int = None, **madx_args):
+        self.size = size
+        self.baseline = baseline
+        self.max_tasks = max_tasks
+        self.max_rss = max_rss
+        self._madx_args = madx_args
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        # LIFO order keeps recently used interpreters busy (their memory
+        # pages are more likely to be resident):
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(self._spawn())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextmanager
+    def acquire(self, timeout: float = None):
+        """
+        Borrow an interpreter for the duration of a ``with`` block.
+
+        :param float timeout: seconds to wait for an idle interpreter
+        :raises queue.Empty: if no interpreter became idle within ``timeout``
+        :raises RuntimeError: if the pool has been closed
+        """
+        if self._closed:
+            raise RuntimeError("MadxPool is closed!")
+        madx = self._idle.get(timeout=timeout)
+        if madx is None:
+            # the slot of an interpreter that could not be replaced:
+            try:
+                madx = self._spawn()
+            except BaseException:
+                self._idle.put(None)
+                raise
+        try:
+            yield madx
+        finally:
+            self._release(madx)
+
+    def close(self):
+        """Stop all idle interpreters. Busy interpreters are stopped as
+        soon as they are returned to the pool."""
+        self._closed = True
+        while True:
+            try:
+                madx = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if madx is not None:
+                self._discard(madx)
+
+    def _spawn(self) -> Madx:
+        madx = Madx(**self._madx_args)
+        if self.baseline:
+            madx.input(self.baseline)
+        with self._lock:
+            self._tasks[madx] = 0
+        return madx
+
+    def _discard(self, madx: Madx):
+        with self._lock:
+            self._tasks.pop(madx, None)
+        with suppress(Exception):
+            madx.quit()
+
+    def _release(self, madx: Madx):
+        """Reset interpreter and put it back to the idle list, or replace it
+        by a fresh interpreter if it is broken or has reached its limits."""
+        if self._closed:
+            self._discard(madx)
+            return
+        with self._lock:
+            self._tasks[madx] += 1
+            tasks = self._tasks[madx]
+        try:
+            if not self._is_exhausted(madx, tasks):
+                if self.baseline:
+                    madx.input(self.baseline)
+                self._idle.put(madx)
+                return
+        except Exception:
+            pass
+        self._discard(madx)
+        try:
+            madx = self._spawn()
+        except Exception:
+            # Keep the slot, the next acquire() tries again to spawn an
+            # interpreter and reports the error:
+            madx = None
+        self._idle.put(madx)
+
+    def _is_exhausted(self, madx: Madx, tasks: int) -> bool:
+        if not madx:
+            return True
+        if self.max_tasks is not None and tasks >= self.max_tasks:
+            return True
+        # in-process instances have no process of their own:
+        if self.max_rss is not None and madx._process is not None:
+            rss = _get_rss(madx._process.pid)
+            if rss is not None and rss > self.max_rss:
+                return True
+        return False
+
+
+def _get_rss(pid: int) -> int:
+    """Return resident set size of the process in bytes, or ``None`` if it
+    cannot be determined on this platform."""
+    try:
+        with open('/proc/{}/statm'.format(pid)) as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    with suppress(AttributeError, ValueError):
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    return None
@@ -8,6 +8,7 @@ __all__ = [
     'Constraint',
     'Parameter',
     'Range',
+    'Categorical',
 
     'AlignError',
     'FieldError',
@@ -59,6 +60,9 @@ dtype_to_native = {
 
 Range = namedtuple('Range', ['first', 'last'])
 
+# Compact string array, equivalent to ``categories[codes]``:
+Categorical = namedtuple('Categorical', ['codes', 'categories'])
+
 AlignError = namedtuple('AlignError', [
     'dx', 'dy', 'ds',
     'dphi', 'dtheta', 'dpsi',
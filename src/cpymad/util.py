@@ -15,7 +15,7 @@ import numpy as np
 
 from cpymad.parsing import Parser
 from cpymad.types import (
-    Range, Constraint,
+    Range, Constraint, Categorical,
     PARAM_TYPE_LOGICAL, PARAM_TYPE_INTEGER,
     PARAM_TYPE_DOUBLE, PARAM_TYPE_STRING, PARAM_TYPE_CONSTRAINT,
     PARAM_TYPE_LOGICAL_ARRAY, PARAM_TYPE_INTEGER_ARRAY,
@@ -31,6 +31,7 @@ __all__ = [
     'format_cmdpar',
     'format_command',
     'check_expression',
+    'compact_assignments',
     'temp_filename',
     'ChangeDirectory',
 ]
@@ -232,6 +233,9 @@ def format_cmdpar(cmd, key: str, value) -> str:
     key = _fix_name(str(key).lower())
     cmdpar = cmd.cmdpar[key]
     dtype = cmdpar.dtype
+    # numpy scalars and arrays are formatted like the equivalent python values:
+    if isinstance(value, (np.ndarray, np.generic)):
+        value = value.tolist()
     # the empty string was used in earlier versions in place of None:
     if value is None or value == '':
         return u''
@@ -478,6 +482,51 @@ def check_expression(expr: str):
     return True
 
 
+_num = r'[+-]?(?:\d+\.?\d*|\.\d+)(?:e[+-]?\d+)?'
+_re_numeric_assignment = re_compile(
+    r'\s*([a-z_][a-z0-9_.]*)\s*=\s*(' + _num + r')\s*;')
+_re_numeric_assignments = re_compile(
+    r'^(?:\s*[a-z_][a-z0-9_.]*\s*=\s*' + _num + r'\s*;)+\s*$')
+
+
+def compact_assignments(inputs: list) -> list:
+    """
+    Compact a list of MAD-X inputs by removing numeric assignments that are
+    overwritten before any other command is executed.
+
+    :param inputs: list of MAD-X input texts
+    :returns: list of MAD-X input texts with the same effect
+
+    Only inputs consisting entirely of assignments of numeric literals (e.g.
+    ``x = 1.5;``) are compacted. Within a run of such inputs, only the last
+    assignment to each variable is retained. All other inputs are kept
+    unchanged, since they may depend on the previous variable values.
+
+    >>> compact_assignments(['x = 1;', 'y = 2; x = 3;', 'twiss;', 'x = 4;'])
+    ['y = 2;\nx = 3;', 'twiss;', 'x = 4;']
+    """
+    result = []
+    run = {}
+    for text in inputs:
+        if _re_numeric_assignments.match(text):
+            for name, value in _re_numeric_assignment.findall(text):
+                run.pop(name.lower(), None)
+                run[name.lower()] = value
+            continue
+        if run:
+            result.append(_format_assignments(run))
+            run = {}
+        result.append(text)
+    if run:
+        result.append(_format_assignments(run))
+    return result
+
+
+def _format_assignments(values: dict) -> str:
+    return '\n'.join(
+        '{} = {};'.format(name, value) for name, value in values.items())
+
+
 # misc
 
 @contextmanager
@@ -529,7 +578,19 @@ class ChangeDirectory:
             self._chdir(self._restore)
 
 
-@np.vectorize
 def remove_count_suffix_from_name(name):
-    """Return the :N suffix from an element name."""
-    return name.rsplit(':', 1)[0]
+    """
+    Remove the :N suffix from an element name.
+
+    Also accepts arrays of names, or a :class:`~cpymad.types.Categorical`,
+    in which case the suffix is removed only once for each distinct value.
+    """
+    if isinstance(name, str):
+        return name.rsplit(':', 1)[0]
+    if isinstance(name, Categorical):
+        categories, codes = np.unique(
+            remove_count_suffix_from_name(name.categories),
+            return_inverse=True)
+        return Categorical(codes[name.codes], categories)
+    names, codes = np.unique(name, return_inverse=True)
+    return np.array([n.rsplit(':', 1)[0] for n in names], dtype=str)[codes]
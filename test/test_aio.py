@@ -0,0 +1,74 @@
+"""
+Tests for the :class:`cpymad.aio.AsyncMadx` API.
+"""
+
+import asyncio
+
+from numpy.testing import assert_allclose
+from pytest import raises
+
+from cpymad.aio import AsyncMadx
+from cpymad.madx import Madx
+
+
+SEQU = """
+qp: quadrupole, l=1, k1=0.1;
+s1: sequence, l=10;
+qp1: qp, at=2;
+qp2: qp, at=6, k1=-0.1;
+endsequence;
+beam;
+use, sequence=s1;
+"""
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_input_eval():
+    async def main():
+        async with AsyncMadx(stdout=False) as madx:
+            assert await madx.input('x = 2')
+            assert await madx.eval('x * 3') == 6
+            assert await madx.eval([1, 'x']) == [1, 2]
+        assert not madx
+    run(main())
+
+
+def test_twiss():
+    async def main():
+        async with AsyncMadx(stdout=False) as madx:
+            await madx.input(SEQU)
+            twiss = await madx.twiss(sequence='s1', betx=1, bety=1)
+            assert 'betx' in await twiss.col_names()
+            data = await twiss.copy(['s', 'betx'])
+            assert set(data) == {'s', 'betx'}
+            return await twiss.column('betx')
+    betx = run(main())
+    with Madx(stdout=False) as madx:
+        madx.input(SEQU)
+        assert_allclose(betx, madx.twiss(sequence='s1', betx=1, bety=1).betx)
+
+
+def test_concurrent():
+    async def task(i):
+        async with AsyncMadx(stdout=False) as madx:
+            await madx.input('x = {};'.format(i))
+            await asyncio.sleep(0)
+            return await madx.eval('x')
+
+    async def main():
+        return await asyncio.gather(*(task(i) for i in range(8)))
+    assert run(main()) == list(range(8))
+
+
+def test_error():
+    async def main():
+        async with AsyncMadx(stdout=False) as madx:
+            with raises(ValueError):
+                await madx.eval('undefined_function(1)')
+            madx._service._proc.kill()
+            with raises(RuntimeError):
+                await madx.input('x = 1;')
+    run(main())
@@ -0,0 +1,76 @@
+"""
+Tests for the :class:`cpymad.executor.MadxExecutor` API.
+"""
+
+import os
+
+from pytest import fixture, raises
+
+from cpymad.executor import MadxExecutor, as_completed
+
+
+SETUP = """
+x = 10;
+"""
+
+
+def add(madx, y, z=0):
+    return madx.eval('x') + y + z
+
+
+def worker_pid(madx, i):
+    return os.getpid()
+
+
+def set_x(madx):
+    madx.input('x = 20;')
+
+
+def element_index(madx, name):
+    return madx.sequence.s1.elements.index(name)
+
+
+@fixture
+def executor():
+    with MadxExecutor(2, SETUP, stdout=False) as executor:
+        yield executor
+
+
+def test_submit(executor):
+    assert executor.submit(add, 1).result() == 11
+    assert executor.submit(add, 1, z=2).result() == 13
+    futures = [executor.submit(add, i) for i in range(6)]
+    assert sorted(f.result() for f in as_completed(futures)) == \
+        list(range(10, 16))
+
+
+def test_map(executor):
+    values = list(range(50))
+    expected = [10 + y + z for y, z in zip(values, values)]
+    assert list(executor.map(add, values, values)) == expected
+    assert list(executor.map(add, values, values, chunksize=7)) == expected
+    pids = set(executor.map(worker_pid, range(20)))
+    assert os.getpid() not in pids
+
+
+def test_setup_function():
+    with MadxExecutor(1, set_x, stdout=False) as executor:
+        assert executor.submit(add, 1).result() == 21
+
+
+def test_inprocess():
+    with MadxExecutor(1, SETUP, inprocess=True, stdout=False) as executor:
+        assert executor.submit(add, 1).result() == 11
+        assert executor.submit(worker_pid, 0).result() != os.getpid()
+
+
+def test_remote_exception():
+    setup = 's1: sequence, l=1; endsequence;'
+    with MadxExecutor(1, setup, stdout=False) as executor:
+        future = executor.submit(element_index, 'nope')
+        with raises(ValueError) as exc_info:
+            future.result()
+        assert type(exc_info.value) is ValueError
+        assert 'nope' in str(exc_info.value)
+        with raises(ValueError):
+            list(executor.map(element_index, ['nope'], chunksize=2))
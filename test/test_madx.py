@@ -3,13 +3,16 @@ Tests for the :class:`cpymad.madx.Madx` API.
 """
 
 import os
+import subprocess
 import sys
+import textwrap
 
 import numpy as np
 from numpy.testing import assert_allclose, assert_equal
-from pytest import approx, fixture, mark, raises
+from pytest import approx, fixture, importorskip, mark, raises
 
 import cpymad
+from cpymad import _shm
 from cpymad.madx import Madx, Sequence, metadata
 
 
@@ -51,6 +54,14 @@ endsequence;
 """
 
 
+def run_isolated(script):
+    """Run python code in a new interpreter and check that it succeeds."""
+    result = subprocess.run(
+        [sys.executable, '-c', textwrap.dedent(script)],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=60)
+    assert result.returncode == 0, result.stdout.decode()
+
+
 def normalize(path):
     """Normalize path name to eliminate different spellings of the same path.
     This is needed for path comparisons in tests, especially on windows where
@@ -95,6 +106,193 @@ def test_independent_instances():
         assert mad2.eval('ANSWER') == 43
 
 
+@mark.skipif(not hasattr(os, 'fork'), reason='fork() is not available.')
+def test_fork(mad):
+    mad.input(SEQU)
+    mad.input('ANSWER=42;')
+    mad1, mad2 = mad.fork(2)
+    with mad1, mad2:
+        assert mad1._service.pid != mad2._service.pid
+        mad1.input('ANSWER=43;')
+        assert mad.eval('ANSWER') == 42
+        assert mad1.eval('ANSWER') == 43
+        assert mad2.eval('ANSWER') == 42
+        assert mad2.sequence.s2.element_names() == \
+            mad.sequence.s2.element_names()
+    assert not mad1
+    assert not mad2
+    assert mad
+
+
+@mark.skipif(not hasattr(os, 'fork'), reason='fork() is not available.')
+def test_fork_settings():
+    with Madx(stdout=False, shared_memory=True, timeout=30) as mad:
+        mad.input(SEQU)
+        mad.command.beam()
+        mad.use('s1')
+        with mad.fork()[0] as child:
+            assert child.table._shared_memory
+            assert child._service.timeout == 30
+            twiss = child.twiss(sequence='s1', betx=1, bety=1)
+            assert_allclose(twiss.betx, mad.twiss(
+                sequence='s1', betx=1, bety=1).betx)
+
+
+def test_recover():
+    with Madx(stdout=False, recover='raise') as mad:
+        mad.input(SEQU)
+        mad.input('x = 1;')
+        mad.input('x = 2;')
+        mad.checkpoint()
+        sequence = mad.sequence.s1
+        pid = mad._process.pid
+        mad._process.kill()
+        mad._process.wait()
+        with raises(RuntimeError):
+            mad.input('y = 3;')
+        assert mad._process.pid != pid
+        assert mad.globals.x == 2
+        assert 'y' not in mad.globals
+        assert sequence.elements.index('dr') == 1
+    with Madx(stdout=False, recover='retry') as mad:
+        mad.input('x = 1;')
+        mad._process.kill()
+        mad._process.wait()
+        assert mad.input('y = x + 2;')
+        assert mad.globals.y == 3
+        assert mad._replay[1:] == ['x = 1;', 'y = x + 2;']
+
+
+def test_recover_cwd(tmp_path, monkeypatch):
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'x.madx').write_text('x = 42;')
+    monkeypatch.chdir(str(tmp_path))
+    with Madx(stdout=False, recover='retry') as mad:
+        mad.chdir('sub')
+        monkeypatch.chdir(str(tmp_path / 'sub'))
+        mad._process.kill()
+        mad._process.wait()
+        mad.input('call, file="x.madx";')
+        assert mad.globals.x == 42
+        assert mad._libmadx.getcwd() == str(tmp_path / 'sub')
+
+
+def test_recover_selection():
+    with Madx(stdout=False, recover='raise') as mad:
+        mad.input(SEQU)
+        mad.command.beam()
+        mad.use('s1')
+        mad.select(flag='twiss', pattern='qp')
+        num_rows = len(mad.twiss(sequence='s1', betx=1, bety=1))
+        mad._process.kill()
+        mad._process.wait()
+        with raises(RuntimeError):
+            mad.input('y = 3;')
+        assert len(mad.table.twiss) == num_rows
+
+
+HANG = 'n = 0; while (n < 1) { x = 1; }'
+
+
+def test_timeout():
+    with Madx(stdout=False, timeout=30) as mad:
+        assert mad.input('x = 1;', timeout=5)
+        with raises(TimeoutError) as exc_info:
+            mad.input(HANG, timeout=0.5)
+        assert HANG in str(exc_info.value)
+        assert not mad
+    with Madx(stdout=False, timeout=0.5, recover='raise') as mad:
+        mad.input('x = 2;')
+        with raises(TimeoutError):
+            mad.input(HANG)
+        assert mad.globals.x == 2
+    with Madx(stdout=False, recover='raise', replay_timeout=0.1) as mad:
+        mad.input('n = 0; while (n < 300000) { n = n + 1; }')
+        mad._process.kill()
+        mad._process.wait()
+        with raises(RuntimeError, match='could not be restarted'):
+            mad.input('x = 2;')
+
+
+def test_timeout_exit():
+    # No watchdog must be started when the client is finalized at exit:
+    run_isolated("""
+        from cpymad.madx import Madx
+        with Madx(stdout=False, timeout=30) as mad:
+            mad.input('x = 1;')
+    """)
+
+
+def test_stats():
+    calls = []
+    with Madx(stdout=False, stats_callback=lambda *a: calls.append(a)) as mad:
+        mad.stats(reset=True)
+        calls.clear()
+        mad.input('x = 1;')
+        mad.eval('x')
+        mad.eval('x')
+        mad.input(SEQU)
+        mad.command.beam()
+        mad.use('s1')
+        mad.twiss(sequence='s1', betx=1, bety=1).betx
+        stats = mad.stats(reset=True)
+        num_calls = len(calls)
+        assert not mad.stats()
+    assert stats['eval'].count == 2
+    assert stats['input'].count == 5
+    assert stats['get_table_column'].bytes_received > 8 * 5
+    for s in stats.values():
+        assert s.wall_time >= s.compute_time >= 0
+        assert s.bytes_sent > 0
+    assert num_calls == sum(s.count for s in stats.values())
+    name, wall_time, compute_time, sent, received = calls[0]
+    assert name == 'input'
+
+
+def test_inprocess():
+    # MAD-X can not be unloaded again, and it breaks later imports of some
+    # modules (e.g. pandas), so we must keep it out of the test process:
+    run_isolated("""
+        from pytest import raises
+        from cpymad.madx import Madx
+        with Madx(inprocess=True) as mad:
+            assert mad._process is None
+            with raises(RuntimeError):
+                Madx(inprocess=True)
+            mad.input({!r})
+            mad.command.beam()
+            mad.use('s1')
+            betx = mad.twiss(sequence='s1', betx=1, bety=1).betx
+            assert betx.flags.owndata
+            assert mad.eval('QP_K1') == 2
+        assert not mad
+        with raises(ValueError):
+            Madx(inprocess=True, stdout=False)
+        with raises(RuntimeError):
+            Madx(inprocess=True)
+    """.format(SEQU))
+
+
+def test_pipeline(mad):
+    mad.input('x = 2; y := 3 * x;')
+    mad.stats(reset=True)
+    with mad._service.pipeline() as libmadx:
+        x = libmadx.eval('x')
+        y = libmadx.eval('y')
+        z = libmadx.get_var_type('z')
+        assert not x.done()
+    stats = mad.stats()
+    assert set(stats) == {'eval', 'get_var_type'}
+    assert stats['eval'].count == 2
+    assert stats['get_var_type'].count == 1
+    assert stats['eval'].wall_time >= stats['eval'].compute_time > 0
+    assert x.result() == 2
+    assert y.result() == 6
+    with raises(KeyError):
+        z.result()
+    assert set(mad.expr_vars('x + y * z')) == {'x', 'y'}
+
+
 # TODO: We need to fix this on windows, but for now, I just need it to
 # pass so that the CI builds the release...
 @mark.xfail(
@@ -439,6 +637,37 @@ def test_globals(mad):
     assert len(g.cmdpar) == len(list(g.cmdpar))
 
 
+def test_globals_update(mad):
+    g = mad.globals
+    history = mad.history = []
+    g.update({'FOO': 1.5, 'bar': np.float64(2), 'baz': 'foo*bar'}, qux=3)
+    assert history == ['foo = 1.5;\nbar = 2.0;\nqux = 3;', 'baz := foo*bar;']
+    assert g.foo == 1.5
+    assert g.bar == 2
+    assert g.qux == 3
+    assert g.baz == 3
+    assert g.defs.baz == 'foo*bar'
+    # direct assignment replaces expressions:
+    g.update(baz=7)
+    assert g.defs.baz == 7
+    g.update(foo=2)
+    assert g.baz == 7
+    # batch mode:
+    with mad.batch():
+        g.update(foo=3, bar=4)
+        assert g.foo == 2
+    assert g.foo == 3
+    assert g.bar == 4
+    assert history[-1] == 'foo = 3;\nbar = 4;'
+    # complex values are rejected before assigning anything:
+    with raises(TypeError):
+        g.update(foo=5, bar=1+2j)
+    with raises(TypeError):
+        g.update(bar=np.complex128(1))
+    assert g.foo == 3
+    assert g.bar == 4
+
+
 def test_elements(mad):
     mad.input(SEQU)
     assert 'sb' in mad.elements
@@ -450,6 +679,51 @@ def test_elements(mad):
     assert elem['k1'] == 3
 
 
+def test_elements_update_many(mad):
+    mad.input(SEQU)
+    history = mad.history = []
+    mad.stats(reset=True)
+    assert mad.elements.update_many({
+        'QP1': {'k1': np.float64(4.5)},
+        'sb': {'angle': 'qp_k1/10', 'l': 3},
+    })
+    assert len(history) == 1
+    assert mad.elements.qp1.k1 == 4.5
+    assert mad.elements.sb.angle == approx(0.2)
+    assert mad.elements.sb.l == 3
+    with raises(KeyError):
+        mad.elements.update_many({'foobar': {'k1': 1}})
+
+    # attribute types are resolved once per base type, not per element:
+    mad.stats(reset=True)
+    assert mad.elements.update_many({'qp1': {'k1': 1}, 'qp2': {'k1': 2}})
+    assert 'get_global_element' not in mad.stats()
+
+    seq = mad.sequence.s2
+    assert seq.set_attribute('k1', ['qp1', 'qp2'], np.array([1.0, 2.0]))
+    assert mad.elements.qp1.k1 == 1
+    assert mad.elements.qp2.k1 == 2
+    assert seq.set_attribute('tilt', ['qp1', 'qp2'], 0.5)
+    assert mad.elements.qp1.tilt == mad.elements.qp2.tilt == 0.5
+    assert len(history) == 4
+    with raises(ValueError):
+        seq.set_attribute('k1', ['qp1', 'qp2'], [1.0])
+    with raises(KeyError):
+        seq.set_attribute('k1', ['qp1', 'qp'], 1.0)
+    assert mad.elements.qp.k1 != 1.0
+    seq = mad.sequence.s1
+    with raises(ValueError):
+        seq.set_attribute('k1', ['qp[1]', 'qp[2]'], [1.0, 2.0])
+    assert mad.elements.qp.k1 != 1.0
+
+    # membership is checked without fetching the element names:
+    mad.stats(reset=True)
+    assert seq.set_attribute('k1', ['qp[1]', 'qp[2]'], [1.0, 1.0])
+    assert mad.elements.qp.k1 == 1.0
+    assert 'get_element_names' not in mad.stats()
+    assert 'get_expanded_element_names' not in mad.stats()
+
+
 def test_sequence_map(mad):
     mad.input(SEQU)
     seq = mad.sequence
@@ -609,6 +883,51 @@ def test_sequence_expanded_elements(mad):
     assert qp2.position == approx(3)
     assert iqp2 == elements.at(3.1)
 
+    positions = [0.5, 1.0, 3.1, 7.9, 9.0, -1]
+    assert list(elements.at_many(positions)) == [
+        elements.at(pos) for pos in positions[:4]] + [-1, -1]
+    assert list(mad.sequence.s1.elements.at_many(positions)) == [
+        mad.sequence.s1.elements.at(pos) for pos in positions[:4]] + [-1, -1]
+
+    names = mad.sequence['s1'].expanded_element_names()
+    for name in names:
+        assert elements.index(name) == names.index(name)
+    assert 'qp[3]' not in elements
+
+    mad.input("""
+        seqedit, sequence=s1;
+        remove, element=qp[1];
+        endedit;
+    """)
+    mad.use('s1')
+    names = mad.sequence['s1'].expanded_element_names()
+    assert 'qp[2]' not in elements
+    assert elements.index('qp') == names.index('qp') == iqp2
+
+
+def test_sequence_element_table(mad):
+    mad.input(SEQU)
+    mad.command.beam()
+    mad.use('s1')
+    seq = mad.sequence.s1
+    for expanded, elements in [(False, seq.elements),
+                               (True, seq.expanded_elements)]:
+        data = seq.element_table(
+            ['k1', 'angle'], expanded=expanded, expressions=True)
+        assert list(data.name) == [elem.node_name for elem in elements]
+        assert list(data.base_type) == [
+            elem.base_type.name for elem in elements]
+        assert list(data.parent) == [elem.parent.name for elem in elements]
+        assert_allclose(data.position, [elem.position for elem in elements])
+        assert_allclose(data.length, [elem.length for elem in elements])
+        assert_allclose(data.k1, [
+            elem.k1 if 'k1' in elem else np.nan for elem in elements])
+        assert list(data.k1_expr) == [
+            elem.cmdpar.k1.expr or '' if 'k1' in elem else ''
+            for elem in elements]
+    assert data.k1[list(data.name).index('qp')] == 2
+    assert data.k1_expr[list(data.name).index('qp')] == 'qp_k1'
+
 
 def test_element_inform(mad):
     beam = 'ex=1, ey=2, particle=electron, sequence=s1;'
@@ -663,6 +982,9 @@ def test_table(mad):
     assert_allclose(sector.rmat(ALL)[1, 5, :], sector.r26)
     assert_allclose(sector.rmat(ALL)[3, 0, :], sector.r41)
     assert_allclose(sector.rmat(ALL)[4, 4, :], sector.r55)
+    assert_allclose(sector.rmat(-1)[1, 5], sector.r26[-1])
+    assert_allclose(sector.rmat(np.int64(2)), sector.rmat(2))
+    assert_allclose(sector.rmat(np.int64(2))[1, 5], sector.r26[2])
 
     assert_allclose(sector.kvec(ALL)[0, :], sector.k1)
     assert_allclose(sector.kvec(ALL)[1, :], sector.k2)
@@ -694,6 +1016,137 @@ def test_table(mad):
     assert_allclose(k[:, 4], sector.k5)
 
 
+@mark.skipif(not _shm.available, reason='shared memory not supported')
+def test_table_shared_memory():
+    with Madx(stdout=False, shared_memory=True) as mad:
+        mad.input(SEQU)
+        mad.command.beam()
+        mad.use('s1')
+        twiss = mad.twiss(sequence='s1', betx=1, bety=1)
+        assert twiss._shared_memory
+        with Madx(stdout=False) as ref:
+            ref.input(SEQU)
+            ref.command.beam()
+            ref.use('s1')
+            expected = ref.twiss(sequence='s1', betx=1, bety=1)
+            assert_allclose(twiss.betx, expected.betx)
+            assert list(twiss.name) == list(expected.name)
+            assert set(twiss.copy()) == set(expected.copy())
+        betx = twiss.betx
+        assert not betx.flags.owndata
+        del twiss
+        assert betx.sum() > 0
+
+
+@mark.skipif(not os.path.isdir('/dev/shm'), reason='requires /dev/shm')
+def test_table_shared_memory_release():
+    with Madx(stdout=False, shared_memory=True) as mad:
+        mad.input(SEQU)
+        mad.command.beam()
+        mad.use('s1')
+        mad.twiss(sequence='s1', betx=1, bety=1)
+        # descriptor that is never attached by the client:
+        data = mad._libmadx.get_table_column('twiss', 'betx', shared=True)
+        path = os.path.join('/dev/shm', data.name.lstrip('/'))
+        assert os.path.exists(path)
+        mad.eval('1')
+        assert not os.path.exists(path)
+
+
+def test_table_cache_invalidation(mad):
+    mad.input(SEQU)
+    mad.command.beam()
+    mad.use('s1')
+    twiss = mad.twiss(sequence='s1', betx=1, bety=1)
+    betx = twiss.betx
+    assert twiss.betx is betx
+
+    mad.globals.QP_K1 = 3
+    assert twiss.betx is betx
+
+    expected = mad.twiss(sequence='s1', betx=1, bety=1).betx
+    assert twiss.betx is not betx
+    assert_equal(twiss.betx, expected)
+    assert twiss.copy(['betx'])['betx'] is twiss.betx
+    assert not np.all(betx == expected)
+
+    # only checked once after every input:
+    mad.stats(reset=True)
+    betx = twiss.betx
+    assert 'get_table_generation' not in mad.stats()
+    mad.input('x = 1;')
+    assert twiss.betx is betx
+    assert twiss.betx is betx
+    assert mad.stats()['get_table_generation'].count == 1
+
+    # tables can be overwritten in place by any command:
+    mad.input('n = 0; while (n < 2) { twiss, sequence=s1, betx=2, bety=1; '
+              'n = n + 1; }')
+    assert twiss.betx is not betx
+    assert twiss.betx[0] == 2
+
+
+def test_table_iter_chunks(mad, lib):
+    mad.input(SEQU)
+    mad.command.beam()
+    mad.use('s1')
+    twiss = mad.twiss(sequence='s1', betx=1, bety=1)
+    chunks = list(twiss.iter_chunks(['name', 'betx'], chunk_rows=4))
+    assert [len(chunk['betx']) for chunk in chunks] == [4, 4, 1]
+    assert_equal(np.hstack([chunk['betx'] for chunk in chunks]), twiss.betx)
+    assert_equal(np.hstack([chunk['name'] for chunk in chunks]), twiss.name)
+
+    mad.select(flag='twiss', class_='drift')
+    lib.apply_table_selections('twiss')
+    chunks = list(twiss.selection().iter_chunks(['betx'], chunk_rows=3))
+    assert [len(chunk['betx']) for chunk in chunks] == [3, 1]
+    assert_equal(np.hstack([chunk['betx'] for chunk in chunks]),
+                 twiss.betx[twiss.selected_rows()])
+
+
+def test_table_arrow(mad, tmp_path):
+    pa = importorskip('pyarrow')
+    pq = importorskip('pyarrow.parquet')
+    mad.input(SEQU)
+    mad.command.beam()
+    mad.use('s1')
+    twiss = mad.twiss(sequence='s1', betx=1, bety=1)
+
+    table = twiss.to_arrow(['name', 'betx', 'keyword'])
+    assert table.column_names == ['name', 'betx', 'keyword']
+    assert pa.types.is_dictionary(table.schema.field('name').type)
+    assert table['name'].to_pylist() == list(twiss.name)
+    assert_equal(table['betx'].to_numpy(), twiss.betx)
+    assert float(table.schema.metadata[b'q1']) == twiss.summary.q1
+
+    path = tmp_path / 'twiss.parquet'
+    twiss.to_parquet(path)
+    table = pq.read_table(path)
+    assert table.column_names == twiss.col_names()
+    assert_equal(table['betx'].to_numpy(), twiss.betx)
+    assert table['keyword'].to_pylist() == list(twiss.keyword)
+    assert float(table.schema.metadata[b'q1']) == twiss.summary.q1
+
+
+def test_table_parquet_subprocess(tmp_path):
+    pq = importorskip('pyarrow.parquet')
+    with Madx(stdout=False) as mad:
+        mad.input(SEQU)
+        mad.command.beam()
+        mad.use('s1')
+        twiss = mad.twiss(sequence='s1', betx=1, bety=1)
+        path = tmp_path / 'twiss.parquet'
+        twiss.to_parquet(str(path), ['name', 'betx'])
+        assert pq.read_table(str(path))['betx'].to_pylist() == \
+            twiss.betx.tolist()
+        # MAD-X process is still alive and has not loaded pyarrow:
+        assert mad.input('x = 1;')
+        maps = '/proc/{}/maps'.format(mad._process.pid)
+        if os.path.exists(maps):
+            with open(maps) as f:
+                assert 'pyarrow' not in f.read()
+
+
 def test_selected_columns(mad, lib):
     mad.input(SEQU)
     mad.command.beam()
@@ -730,6 +1183,12 @@ def test_table_selected_rows(mad, lib):
         assert_equal(
             table.column(name, rows='selected'),
             table.selection()[name])
+        assert_equal(
+            table.copy([name, 'name'], rows='selected')[name],
+            table[name][table.selected_rows()])
+        assert_equal(
+            table.copy([name, 'name'], rows='selected')['name'],
+            table.name[table.selected_rows()])
 
     mad.select(flag='twiss', class_='quadrupole')
     table = mad.twiss(sequence='s1', betx=1, bety=1)
@@ -750,6 +1209,28 @@ def test_table_selected_rows(mad, lib):
     check_selection(table, 'bety')
 
 
+def test_table_selected_rows_invalidation(mad):
+    mad.input(SEQU)
+    mad.command.beam()
+    mad.use('s1')
+
+    mad.select(flag='twiss', class_='quadrupole')
+    table = mad.twiss(sequence='s1', betx=1, bety=1)
+    selection = table.selection(['betx', 'name'])
+    assert table.selected_rows() == [2, 4]
+    betx = selection.betx
+    assert len(betx) == 2
+    assert selection.betx is betx
+
+    mad.select(flag='twiss', clear=True)
+    mad.select(flag='twiss', class_='drift')
+    mad.twiss(sequence='s1', betx=1, bety=1)
+    assert table.selected_rows() == [1, 3, 5, 7]
+    assert selection.betx is not betx
+    assert_equal(selection.betx, table.betx[[1, 3, 5, 7]])
+    assert_equal(selection.name, table.name[[1, 3, 5, 7]])
+
+
 def test_table_selected_rows_mask(mad, lib):
     mad.input(SEQU)
     mad.command.beam()
@@ -950,6 +1431,16 @@ def test_errors(mad):
     assert_allclose(al.dx, 1e-3)
     assert_allclose(al.dy, -4e-3)
 
+    errors = mad.sequence['s1'].error_arrays()
+    elements = mad.sequence['s1'].expanded_elements
+    assert list(errors.name) == ['qp']
+    assert list(errors.index) == [elements.index('qp')]
+    assert errors.align.shape == (1, 14)
+    assert_allclose(errors.align[0], list(al))
+    assert_allclose(errors.dkn[0], fd.dkn)
+    assert_allclose(errors.dks[0], fd.dks)
+    assert errors.dpn.shape == (1, 0)
+
 
 def test_subsequence(mad):
     mad.input("""
@@ -994,6 +1485,8 @@ def test_dframe_after_use(mad):
     assert index == twiss.row_names()
     assert index == twiss.dframe().index.tolist()
     assert names == twiss.dframe(index='name').index.tolist()
+    assert twiss.dframe()['keyword'].dtype == 'category'
+    assert list(twiss.dframe()['keyword']) == list(twiss.keyword)
 
     mad.use(sequence='fodo')
 
@@ -0,0 +1,71 @@
+"""
+Tests for the :mod:`cpymad.montecarlo` module.
+"""
+
+import numpy as np
+from numpy.testing import assert_allclose
+
+from cpymad.madx import Madx
+from cpymad.montecarlo import OnlineStats, run
+
+
+SETUP = """
+qp: quadrupole, l=1, k1=0.3;
+s1: sequence, l=12;
+qp1: qp, at=2;
+qp2: qp, at=6, k1=-0.3;
+qp3: qp, at=10;
+endsequence;
+beam;
+"""
+
+ERRORS = """
+select, flag=error, class=quadrupole;
+ealign, dx:=1e-3*gauss(), dy:=$seed*1e-5;
+"""
+
+TWISS = dict(betx=1, bety=1)
+
+
+def test_run():
+    seeds = range(1, 13)
+    received = []
+    stats = run(SETUP, 's1', ERRORS, seeds, ['x', 'y', 'betx'],
+                twiss=TWISS, percentiles=[50], max_workers=2, chunksize=3,
+                callback=lambda seed, data: received.append(seed),
+                stdout=False)
+    assert sorted(received) == list(seeds)
+    x, y = [], []
+    with Madx(stdout=False) as madx:
+        madx.input(SETUP)
+        for seed in seeds:
+            madx.use(sequence='s1')
+            madx.command.eoption(seed=seed)
+            madx.input(ERRORS.replace('$seed', str(seed)))
+            twiss = madx.twiss(sequence='s1', **TWISS)
+            x.append(twiss.x)
+            y.append(twiss.y)
+    assert stats['x'].count == len(seeds)
+    assert_allclose(stats['x'].mean, np.mean(x, axis=0), atol=1e-15)
+    assert_allclose(stats['x'].std, np.std(x, axis=0, ddof=1), atol=1e-15)
+    assert_allclose(stats['y'].max, np.max(y, axis=0))
+    assert_allclose(stats['y'].min, np.min(y, axis=0))
+    assert np.any(stats['x'].std > 0)
+    assert stats['betx'].percentile(50).shape == stats['betx'].mean.shape
+
+
+def test_online_stats():
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(2000, 3)) * [1, 2, 3] + [0, 1, 2]
+    stats = OnlineStats([10, 50, 90])
+    for i, row in enumerate(data):
+        stats.update(row)
+        if i == 2:
+            assert_allclose(stats.percentile(50), np.median(data[:3], axis=0))
+    assert_allclose(stats.mean, data.mean(axis=0))
+    assert_allclose(stats.var, data.var(axis=0, ddof=1))
+    assert_allclose(stats.min, data.min(axis=0))
+    assert_allclose(stats.max, data.max(axis=0))
+    for p in (10, 50, 90):
+        assert_allclose(stats.percentile(p),
+                        np.percentile(data, p, axis=0), atol=0.1)
@@ -0,0 +1,131 @@
+"""
+Tests for the :class:`cpymad.pool.MadxPool` API.
+"""
+
+import queue
+import sys
+
+from pytest import fixture, mark, raises
+
+from cpymad.pool import MadxPool
+
+
+BASELINE = """
+x = 1;
+"""
+
+
+@fixture
+def pool():
+    with MadxPool(2, BASELINE, stdout=False) as pool:
+        yield pool
+
+
+def test_acquire(pool):
+    with pool.acquire() as mad1, pool.acquire() as mad2:
+        assert mad1 and mad2
+        assert mad1 is not mad2
+        assert mad1.globals.x == 1
+        assert mad2.globals.x == 1
+    with raises(queue.Empty):
+        with pool.acquire() as mad1, pool.acquire() as mad2:
+            with pool.acquire(timeout=0):
+                pass
+
+
+def test_reuse_and_reset(pool):
+    with pool.acquire() as mad:
+        pid = mad._process.pid
+        mad.globals.x = 2
+        mad.globals.y = 3
+    with pool.acquire() as mad:
+        assert mad._process.pid == pid
+        assert mad.globals.x == 1
+        # not part of the baseline:
+        assert mad.globals.y == 3
+
+
+def test_max_tasks():
+    with MadxPool(1, BASELINE, max_tasks=2, stdout=False) as pool:
+        with pool.acquire() as mad:
+            pid = mad._process.pid
+        with pool.acquire() as mad:
+            assert mad._process.pid == pid
+        with pool.acquire() as mad:
+            assert mad._process.pid != pid
+            assert mad.globals.x == 1
+
+
+@mark.skipif(
+    not sys.platform.startswith('linux'),
+    reason='Memory usage is only determined on linux.',
+)
+def test_max_rss():
+    with MadxPool(1, max_rss=1, stdout=False) as pool:
+        with pool.acquire() as mad:
+            pid = mad._process.pid
+        with pool.acquire() as mad:
+            assert mad._process.pid != pid
+
+
+def test_replace_crashed(pool):
+    with pool.acquire() as mad:
+        pid = mad._process.pid
+        mad._process.kill()
+        mad._process.wait()
+    for _ in range(2):
+        with pool.acquire() as mad:
+            assert mad
+            assert mad._process.pid != pid
+
+
+def test_close():
+    pool = MadxPool(1, stdout=False)
+    with pool.acquire() as mad:
+        pass
+    pool.close()
+    assert not mad
+    with raises(RuntimeError):
+        with pool.acquire():
+            pass
+
+
+def test_replace_timed_out():
+    with MadxPool(1, BASELINE, timeout=5, stdout=False) as pool:
+        with raises(TimeoutError):
+            with pool.acquire() as mad:
+                pid = mad._process.pid
+                mad.input('n = 0; while (n < 1) { x = 1; }', timeout=0.5)
+        with pool.acquire() as mad:
+            assert mad._process.pid != pid
+            assert mad.globals.x == 1
+
+
+def test_replace_failed_replay():
+    with MadxPool(1, BASELINE, stdout=False) as pool:
+        with pool.acquire() as mad:
+            pid = mad._process.pid
+
+            # replaying the baseline fails with an unexpected exception:
+            def fail(text):
+                del mad.input
+                raise ValueError(text)
+            mad.input = fail
+        with pool.acquire(timeout=5) as mad:
+            assert mad._process.pid != pid
+            assert mad.globals.x == 1
+
+
+def test_replace_failed_spawn():
+    with MadxPool(1, BASELINE, max_tasks=1, stdout=False) as pool:
+        spawn = pool._spawn
+        pool._spawn = lambda: 1 / 0
+        with pool.acquire() as mad:
+            pass
+        assert not mad
+        with raises(ZeroDivisionError):
+            with pool.acquire(timeout=5):
+                pass
+        pool._spawn = spawn
+        with pool.acquire(timeout=5) as mad:
+            assert mad.globals.x == 1
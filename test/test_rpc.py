@@ -0,0 +1,76 @@
+"""
+Tests for :mod:`cpymad._rpc`.
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+from numpy.testing import assert_equal
+from pytest import fixture, mark, raises
+
+from cpymad._rpc import Connection, _open_fifo, _Watchdog
+
+
+@fixture
+def conn():
+    recv_fd, send_fd = os.pipe()
+    conn = Connection.from_fd(recv_fd, send_fd)
+    yield conn
+    conn.close()
+
+
+def roundtrip(conn, data):
+    # use a thread to avoid deadlocks when the data exceeds the pipe buffer:
+    thread = threading.Thread(target=conn.send, args=(data,))
+    thread.start()
+    result = conn.recv()
+    thread.join()
+    return result
+
+
+def test_roundtrip(conn):
+    data = ('data', ({'a': [1, 'x', None], 'b': b''},))
+    assert roundtrip(conn, data) == data
+
+
+def test_out_of_band_arrays(conn):
+    arrays = [
+        np.arange(1000000, dtype=float),
+        np.zeros((0,)),
+        np.arange(24, dtype=np.int32).reshape((2, 3, 4)),
+        np.arange(10.0)[::2],
+        np.array(['a', 'bc']),
+    ]
+    result = roundtrip(conn, arrays)
+    for a, b in zip(arrays, result):
+        assert_equal(a, b)
+        assert a.dtype == b.dtype
+    assert result[0].flags.writeable
+    assert not result[0].flags.owndata
+
+
+@mark.skipif(not hasattr(os, 'mkfifo'), reason='mkfifo() is not available.')
+def test_open_fifo_timeout(tmp_path):
+    path = str(tmp_path / 'fifo')
+    os.mkfifo(path)
+    with raises(TimeoutError):
+        _open_fifo(path, os.O_WRONLY, time.monotonic() + 0.1)
+    with _open_fifo(path, os.O_RDONLY, time.monotonic()) as recv:
+        with _open_fifo(path, os.O_WRONLY, time.monotonic()) as send:
+            send.write(b'x')
+            assert recv.read(1) == b'x'
+
+
+def test_watchdog():
+    kills = []
+    watchdog = _Watchdog(10, lambda: kills.append(1))
+    assert watchdog.cancel()
+    watchdog._expire()
+    assert not watchdog.expired
+    watchdog = _Watchdog(0.01, lambda: kills.append(1))
+    watchdog._timer.join()
+    assert not watchdog.cancel()
+    assert watchdog.expired
+    assert kills == [1]
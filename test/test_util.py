@@ -4,7 +4,8 @@ Tests for the functionality in :mod:`cpymad.util`.
 
 from cpymad import util
 from cpymad.madx import Madx, AttrDict
-from cpymad.types import Range, Constraint
+from cpymad.types import Range, Constraint, Categorical
+import numpy as np
 import pytest
 
 
@@ -61,6 +62,18 @@ def test_name_to_internal():
         util.name_to_internal('foo:23o')
 
 
+def test_remove_count_suffix_from_name():
+    assert util.remove_count_suffix_from_name('dr:12') == 'dr'
+    assert util.remove_count_suffix_from_name('s1$start') == 's1$start'
+    names = ['dr:1', 'qp:1', 'dr:2', '#s']
+    assert list(util.remove_count_suffix_from_name(names)) == [
+        'dr', 'qp', 'dr', '#s']
+    data = Categorical([0, 1, 2, 0], ['dr:1', 'qp:1', 'dr:2'])
+    data = util.remove_count_suffix_from_name(data)
+    assert list(data.categories) == ['dr', 'qp']
+    assert list(data.categories[data.codes]) == ['dr', 'qp', 'dr', 'dr']
+
+
 def test_normalize_range_name():
     assert util.normalize_range_name('dr[1]') == 'dr[1]'
     assert util.normalize_range_name('lebt$start') == '#s'
@@ -169,6 +182,8 @@ def test_format_cmdpar(mad):
     assert fmt(mult, 'kmin', 3) == 'kmin=3'
     assert fmt(mult, 'kmin', 3.14) == 'kmin=3.14'
     assert fmt(mult, 'kmin', "x/(b+c)") == 'kmin:=x/(b+c)'
+    assert fmt(mult, 'kmin', np.float64(3.5)) == 'kmin=3.5'
+    assert fmt(mult, 'knl', np.array([1.5, 2.5])) == 'knl={1.5,2.5}'
 
     assert fmt(match, 'sequence', 'seq') == 'sequence=seq'
     assert fmt(match, 'sequence', ['s0', 's1']) == 'sequence={s0,s1}'
@@ -215,6 +230,26 @@ def test_check_expression():
     assert not is_valid_expression('^(2)')
 
 
+def test_compact_assignments():
+    assert util.compact_assignments([
+        'x = 1;',
+        'y = 2; x = 3;',
+        'twiss;',
+        'x = 4;',
+        'a=-1.5e-3;',
+        'b := 3;',
+        'c = 1; d = x;',
+        'c = 2;',
+    ]) == [
+        'y = 2;\nx = 3;',
+        'twiss;',
+        'x = 4;\na = -1.5e-3;',
+        'b := 3;',
+        'c = 1; d = x;',
+        'c = 2;',
+    ]
+
+
 def test_attrdict():
     pi = 3.14
     d = AttrDict({'foo': 'bar', 'pi': pi})